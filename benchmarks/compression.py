@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Show when compressing cache files pays for itself.
+
+Writes synthetic review request rows and a user directory with the cpickle
+and marshal serializers, uncompressed and with every available codec, and
+prints the time to serialize and to load each from memory and the file
+size. A compressed file is faster to read than the uncompressed one as
+long as the disk delivers less than the break-even rate:
+
+    bytes saved / extra time spent decompressing
+
+    python benchmarks/compression.py [number of review requests ...]
+"""
+from __future__ import print_function, unicode_literals
+
+from io import BytesIO
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from serializers import review_requests, user_directory  # noqa: E402
+from workflow import manager  # noqa: E402
+from workflow.workflow import COMPRESSION_CODECS  # noqa: E402
+from workflow.workflow import _codec, dump_file, load_file  # noqa: E402
+
+SERIALIZERS = ['cpickle', 'marshal']
+
+
+def codecs():
+    available = [None]
+    for name in COMPRESSION_CODECS:
+        try:
+            _codec(name)
+        except ValueError:
+            continue
+        available.append(name)
+    return available
+
+
+def run(name, data, repeat=5):
+    print('{0}:'.format(name))
+    print('{0:<10} {1:<6} {2:>8} {3:>8} {4:>8} {5:>14}'.format(
+        'serializer', 'codec', 'dump ms', 'load ms', 'KiB',
+        'pays below'))
+    for serializer_name in SERIALIZERS:
+        serializer = manager.serializer(serializer_name)
+        plain = None
+        for codec in codecs():
+            buf = BytesIO()
+            dump_file(serializer, data, buf, codec)
+            raw = buf.getvalue()
+            dump = min(timeit.repeat(
+                lambda: dump_file(serializer, data, BytesIO(), codec),
+                number=1, repeat=repeat))
+            load = min(timeit.repeat(
+                lambda: load_file(serializer, BytesIO(raw)),
+                number=1, repeat=repeat))
+            if plain is None:
+                plain = (load, len(raw))
+                breakeven = '-'
+            elif load <= plain[0]:
+                breakeven = 'always'
+            else:
+                breakeven = '{0:.0f} MB/s'.format(
+                    (plain[1] - len(raw)) / (load - plain[0]) / 1e6)
+            print('{0:<10} {1:<6} {2:>8.1f} {3:>8.1f} {4:>8.0f} {5:>14}'.format(
+                serializer_name, codec or '-', dump * 1000, load * 1000,
+                len(raw) / 1024.0, breakeven))
+    print()
+
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or [10000]
+    for count in counts:
+        run('{0} review requests'.format(count), review_requests(count))
+    run('user directory', user_directory())
+
+
+if __name__ == '__main__':
+    main()
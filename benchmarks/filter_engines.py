@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Compare the item-by-item and NumPy engines of Workflow.filter.
+
+Filters synthetic review request summaries with both engines, checks
+that they return the same results in the same order and prints the time
+each takes per query. The NumPy engine keeps the arrays it builds from the
+keys between queries; the first query, which builds them, is timed
+separately.
+
+    python benchmarks/filter_engines.py [number of summaries ...]
+"""
+from __future__ import print_function, unicode_literals
+
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from workflow import MATCH_ALL  # noqa: E402
+from workflow import MATCH_ALLCHARS  # noqa: E402
+from workflow import Workflow  # noqa: E402
+from workflow import batchfilter  # noqa: E402
+
+WORDS = (
+    'Fix Add Remove Refactor Update Bump Revert Use Cache Handle Speed up '
+    'search filter index daemon review request user directory page '
+    'fetcher timeout SQLite store session API root settings Alfred '
+    'Workflow RBTools pagination unicode café naïve déjà vu').split()
+QUERIES = ['fix', 'rs', 'cache page', 'srch', 'cafe', 'ru d', 'xyz']
+RULES = [('all', MATCH_ALL), ('no allchars', MATCH_ALL ^ MATCH_ALLCHARS)]
+
+
+def summaries(count):
+    rnd = random.Random(count)
+    return ['{0} #{1}'.format(' '.join(rnd.sample(WORDS, rnd.randint(3, 9))),
+                              i)
+            for i in range(count)]
+
+
+def run(wf, count, repeat=5):
+    keys = [wf.filter_key(summary) for summary in summaries(count)]
+    pairs = [(key.value, key) for key in keys]
+    batchfilter._last_columns = None
+    build = timeit.timeit(lambda: list(batchfilter.filter_matches(
+        wf, wf._filter_words('fix', True), pairs, MATCH_ALL)), number=1)
+    print('{0} summaries, first numpy query incl. arrays: {1:.1f} ms'.format(
+        count, build * 1000))
+    print('{0:<12} {1:<12} {2:>10} {3:>10} {4:>8}'.format(
+        'query', 'rules', 'python ms', 'numpy ms', 'matches'))
+    for query in QUERIES:
+        words = wf._filter_words(query, True)
+        for name, match_on in RULES:
+            engines = [
+                lambda: list(wf._filter_matches(words, pairs, match_on)),
+                lambda: list(batchfilter.filter_matches(
+                    wf, words, pairs, match_on)),
+            ]
+            expected, actual = [sorted(engine()) for engine in engines]
+            assert expected == actual, (query, name)
+            times = [min(timeit.repeat(engine, number=1, repeat=repeat))
+                     for engine in engines]
+            print('{0:<12} {1:<12} {2:>10.1f} {3:>10.1f} {4:>8}'.format(
+                query, name, times[0] * 1000, times[1] * 1000,
+                len(expected)))
+    print()
+
+
+def main():
+    wf = Workflow()
+    counts = [int(arg) for arg in sys.argv[1:]] or [1000, 5000, 20000]
+    for count in counts:
+        run(wf, count)
+
+
+if __name__ == '__main__':
+    main()
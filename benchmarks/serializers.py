@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Compare the cache serializers on review request sized data.
+
+Dumps and loads synthetic review request rows (with datetimes) and a user
+directory (without) with every registered serializer, checks the data
+come back unchanged and prints the time each takes and the file size.
+Serializers that can't handle a payload, e.g. JSON and datetimes, are
+skipped.
+
+    python benchmarks/serializers.py [number of review requests ...]
+"""
+from __future__ import print_function, unicode_literals
+
+from datetime import datetime, timedelta
+from io import BytesIO
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from workflow import manager  # noqa: E402
+
+WORDS = (
+    'Fix Add Remove Refactor Update Bump Revert Use Cache Handle Speed up '
+    'search filter index daemon review request user directory page '
+    'fetcher timeout SQLite store session API root settings café').split()
+USERS = ['user{0}'.format(i) for i in range(200)]
+STATUSES = ['pending', 'submitted', 'discarded']
+
+
+def review_requests(count):
+    rnd = random.Random(count)
+    start = datetime(2015, 1, 1)
+    rows = []
+    for i in range(count):
+        added = start + timedelta(seconds=rnd.randint(0, 10 ** 8),
+                                  microseconds=rnd.randint(0, 999999))
+        rows.append({
+            'id': i,
+            'summary': ' '.join(rnd.sample(WORDS, rnd.randint(3, 9))),
+            'status': rnd.choice(STATUSES),
+            'submitter': rnd.choice(USERS),
+            'repo': 'repo{0}'.format(rnd.randint(0, 30)),
+            'time_added': added,
+            'last_updated': added + timedelta(hours=rnd.randint(0, 500)),
+            'ship_it_count': rnd.randint(0, 3),
+            'issue_open_count': rnd.randint(0, 5),
+            'absolute_url': 'https://reviewboard.example.com/r/{0}/'.format(
+                i),
+            'target_people': rnd.sample(USERS, rnd.randint(0, 4)),
+            'primary_reviewers': rnd.sample(USERS, rnd.randint(0, 2)),
+        })
+    return rows
+
+
+def user_directory():
+    return dict((name, {
+        'username': name,
+        'fullname': 'User {0}'.format(name[4:]),
+        'email': '{0}@example.com'.format(name),
+    }) for name in USERS * 10)
+
+
+def run(name, data, repeat=5):
+    print('{0}:'.format(name))
+    print('{0:<10} {1:>10} {2:>10} {3:>10}'.format(
+        'serializer', 'dump ms', 'load ms', 'KiB'))
+    for serializer_name in manager.serializers:
+        serializer = manager.serializer(serializer_name)
+        buf = BytesIO()
+        try:
+            serializer.dump(data, buf)
+        except (TypeError, ValueError):
+            print('{0:<10} {1:>10}'.format(serializer_name, 'n/a'))
+            continue
+        raw = buf.getvalue()
+        if serializer_name != 'json':  # turns tuples into lists
+            assert serializer.load(BytesIO(raw)) == data, serializer_name
+        dump = min(timeit.repeat(lambda: serializer.dump(data, BytesIO()),
+                                 number=1, repeat=repeat))
+        load = min(timeit.repeat(lambda: serializer.load(BytesIO(raw)),
+                                 number=1, repeat=repeat))
+        print('{0:<10} {1:>10.1f} {2:>10.1f} {3:>10.0f}'.format(
+            serializer_name, dump * 1000, load * 1000, len(raw) / 1024.0))
+    print()
+
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or [1000, 10000]
+    for count in counts:
+        run('{0} review requests'.format(count), review_requests(count))
+    run('user directory', user_directory())
+
+
+if __name__ == '__main__':
+    main()
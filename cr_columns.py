@@ -0,0 +1,202 @@
+"""Memory-mapped columnar snapshot of the review request store
+
+Searches without free-text terms read every review request of a view,
+but only LIMIT of them are shown. Rather than building a dict per row
+from SQLite, they read this snapshot: each column is a fixed-width array,
+string columns hold indexes into a table of their distinct values, and
+rows are returned as ``Row`` views that read a column only when it is
+accessed. Filtering on a column looks at its distinct values once and
+then scans the index array, without touching any row.
+
+The snapshot records the ``ReviewRequestStore.version`` it was built
+from and is rebuilt once the store changes, see
+``RBFlow.get_cr_columns``.
+
+Layout (integers are little-endian)::
+
+    MAGIC | version int32 | count uint32 | strings uint32
+    | column * len(COLUMNS) | offset uint32 * (strings + 1) | heap
+    column = int64 * count for TIME_COLUMNS, else uint32 * count
+
+Rows are stored newest first. The string at index ``i`` is
+``heap[offset[i]:offset[i + 1]]`` in UTF-8, index NULL stands for None.
+List columns are stored comma separated, as in the store.
+"""
+from datetime import timedelta
+import mmap
+import struct
+
+from cr_store import COLUMNS
+from cr_store import EPOCH
+from cr_store import INT_COLUMNS
+from cr_store import LIST_COLUMNS
+from cr_store import TIME_COLUMNS
+from cr_store import to_micros
+from workflow.workflow import atomic_writer
+
+MAGIC = b'RBCOLS01'
+HEADER = struct.Struct('<8siII')
+# string index standing for None, e.g. a request without repository
+NULL = 0xffffffff
+
+
+def _width(column):
+    return 8 if column in TIME_COLUMNS else 4
+
+
+def build(path, rows, version):
+    """Write the snapshot of ``rows`` (ReviewRequests as returned by
+    ReviewRequestStore.requests, newest first) taken at store ``version``
+    to ``path``, replacing any existing file atomically.
+    """
+    strings = {}
+    columns = []
+    for column in COLUMNS:
+        # the compact values, microseconds for TIME_COLUMNS
+        if column in TIME_COLUMNS or column in INT_COLUMNS:
+            values = [getattr(row, column) for row in rows]
+        else:
+            values = []
+            for row in rows:
+                value = getattr(row, column)
+                if column in LIST_COLUMNS:
+                    value = ','.join(value)
+                if value is None:
+                    values.append(NULL)
+                else:
+                    values.append(strings.setdefault(value, len(strings)))
+        columns.append(struct.pack(
+            '<{}{}'.format(len(rows), 'q' if column in TIME_COLUMNS else 'I'),
+            *values))
+
+    heap = [None] * len(strings)
+    for value, i in strings.items():
+        heap[i] = value.encode('utf-8')
+    offsets = [0]
+    for value in heap:
+        offsets.append(offsets[-1] + len(value))
+
+    with atomic_writer(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, version, len(rows), len(strings)))
+        f.write(b''.join(columns))
+        f.write(struct.pack('<{}I'.format(len(offsets)), *offsets))
+        f.write(b''.join(heap))
+
+
+class ReviewRequestColumns(object):
+    """Read-only view of a snapshot written by ``build``"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm.size() < HEADER.size:
+            raise ValueError('Not a review request snapshot: {}'.format(path))
+        magic, self.version, self.count, strings = HEADER.unpack_from(
+            self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError('Not a review request snapshot: {}'.format(path))
+        self._starts = {}
+        start = HEADER.size
+        for column in COLUMNS:
+            self._starts[column] = start
+            start += _width(column) * self.count
+        self._offsets = struct.unpack_from(
+            '<{}I'.format(strings + 1), self._mm, start)
+        self._heap = start + 4 * (strings + 1)
+        self._arrays = {}
+        self._strings = {}
+
+    def close(self):
+        self._mm.close()
+
+    def array(self, column):
+        """Return the raw values of ``column``: numbers, microseconds
+        since the epoch for TIME_COLUMNS, string indexes for the rest
+        """
+        if column not in self._arrays:
+            self._arrays[column] = struct.unpack_from(
+                '<{}{}'.format(
+                    self.count, 'q' if column in TIME_COLUMNS else 'I'),
+                self._mm, self._starts[column])
+        return self._arrays[column]
+
+    def string(self, i):
+        if i == NULL:
+            return None
+        if i not in self._strings:
+            start, end = self._offsets[i], self._offsets[i + 1]
+            self._strings[i] = self._mm[
+                self._heap + start:self._heap + end].decode('utf-8')
+        return self._strings[i]
+
+    def value(self, column, i):
+        """Return the value of ``column`` in row ``i``, typed as in the
+        store's row dicts
+        """
+        raw = self.array(column)[i]
+        if column in INT_COLUMNS:
+            return raw
+        if column in TIME_COLUMNS:
+            return EPOCH + timedelta(microseconds=raw)
+        value = self.string(raw)
+        if column in LIST_COLUMNS:
+            return value.split(',') if value else []
+        return value
+
+    def select(self, submitter=None, target=None, status=None, repo=None,
+               updated_since=None, updated_before=None):
+        """Return ``Row`` views of the review requests matching all given
+        filters (as for ReviewRequestStore.requests), newest first
+        """
+        selected = range(self.count)
+        if updated_since is not None or updated_before is not None:
+            array = self.array('last_updated')
+            low = -2 ** 63 if updated_since is None else to_micros(
+                updated_since)
+            high = 2 ** 63 if updated_before is None else to_micros(
+                updated_before)
+            selected = [i for i in selected if low <= array[i] < high]
+        for column, wanted in [('submitter', submitter),
+                               ('status', status),
+                               ('repo', repo),
+                               ('target_people', target)]:
+            if wanted is None:
+                continue
+            array = self.array(column)
+            if column == 'target_people':
+                codes = {code for code in set(array)
+                         if wanted in self.string(code).split(',')}
+            else:
+                codes = {code for code in set(array)
+                         if self.string(code) == wanted}
+            selected = [i for i in selected if array[i] in codes]
+        return [Row(self, i) for i in selected]
+
+
+class Row(object):
+    """One review request of a snapshot, read-only and dict-like. Values
+    are read from the snapshot when accessed.
+    """
+    __slots__ = ('_columns', '_index')
+
+    def __init__(self, columns, index):
+        self._columns = columns
+        self._index = index
+
+    def __getitem__(self, column):
+        if column not in self._columns._starts:
+            raise KeyError(column)
+        return self._columns.value(column, self._index)
+
+    def get(self, column, default=None):
+        try:
+            return self[column]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return list(COLUMNS)
+
+    def __repr__(self):
+        return 'Row({!r})'.format(dict(self))
@@ -0,0 +1,430 @@
+from datetime import datetime, timedelta
+import re
+import sqlite3
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS review_requests (
+    id INTEGER PRIMARY KEY,
+    summary TEXT NOT NULL,
+    status TEXT NOT NULL,
+    submitter TEXT NOT NULL,
+    repo TEXT,
+    time_added TIMESTAMP NOT NULL,
+    last_updated TIMESTAMP NOT NULL,
+    ship_it_count INTEGER NOT NULL,
+    issue_open_count INTEGER NOT NULL,
+    absolute_url TEXT NOT NULL,
+    target_people TEXT NOT NULL,
+    primary_reviewers TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS review_requests_submitter
+    ON review_requests (submitter, last_updated);
+CREATE INDEX IF NOT EXISTS review_requests_status
+    ON review_requests (status, last_updated);
+CREATE INDEX IF NOT EXISTS review_requests_repo
+    ON review_requests (repo, last_updated);
+CREATE INDEX IF NOT EXISTS review_requests_last_updated
+    ON review_requests (last_updated);
+
+CREATE TABLE IF NOT EXISTS target_people (
+    username TEXT NOT NULL,
+    request_id INTEGER NOT NULL REFERENCES review_requests (id),
+    PRIMARY KEY (username, request_id)
+);
+CREATE INDEX IF NOT EXISTS target_people_request_id
+    ON target_people (request_id);
+
+CREATE TABLE IF NOT EXISTS sync_state (
+    query TEXT PRIMARY KEY,
+    last_updated TIMESTAMP,
+    synced_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS full_sync (
+    query TEXT PRIMARY KEY,
+    synced_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS sync_attempt (
+    query TEXT PRIMARY KEY,
+    attempted_at REAL NOT NULL,
+    failures INTEGER NOT NULL
+);
+"""
+
+COLUMNS = [
+    'id', 'summary', 'status', 'submitter', 'repo', 'time_added',
+    'last_updated', 'ship_it_count', 'issue_open_count', 'absolute_url',
+    'target_people', 'primary_reviewers']
+# columns ``requests`` can filter on through an index
+INDEXED_COLUMNS = {'status', 'submitter', 'repo'}
+# list valued columns, stored comma separated
+LIST_COLUMNS = {'target_people', 'primary_reviewers'}
+# datetime columns, held as microseconds since the epoch by ReviewRequest
+TIME_COLUMNS = {'time_added', 'last_updated'}
+# integer columns
+INT_COLUMNS = {'id', 'ship_it_count', 'issue_open_count'}
+# string columns whose values repeat across requests
+INTERNED_COLUMNS = {'status', 'submitter', 'repo'}
+EPOCH = datetime(1970, 1, 1)
+# full-text modules to try, best first
+FTS_MODULES = ['fts5', 'fts4']
+
+
+_interned = {}
+
+
+def _intern(value):
+    # ``intern`` only takes byte strings on Python 2
+    return _interned.setdefault(value, value)
+
+
+def to_micros(dt):
+    """Return naive datetime ``dt`` as microseconds since the epoch"""
+    delta = dt - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+class ReviewRequest(object):
+    """One review request, readable like a dict of COLUMNS
+
+    Repeated strings (status, submitter, repo and user names) are shared
+    between requests, timestamps are held as microseconds since the epoch
+    and list columns as tuples; ``row[column]`` turns them back into
+    datetimes and lists. The attributes hold the compact values.
+    """
+    __slots__ = tuple(COLUMNS)
+
+    def __init__(self, id, summary, status, submitter, repo, time_added,
+                 last_updated, ship_it_count, issue_open_count,
+                 absolute_url, target_people, primary_reviewers):
+        self.id = id
+        self.summary = summary
+        self.status = _intern(status)
+        self.submitter = _intern(submitter)
+        self.repo = None if repo is None else _intern(repo)
+        self.time_added = to_micros(time_added)
+        self.last_updated = to_micros(last_updated)
+        self.ship_it_count = ship_it_count
+        self.issue_open_count = issue_open_count
+        self.absolute_url = absolute_url
+        self.target_people = tuple(_intern(u) for u in target_people)
+        self.primary_reviewers = tuple(
+            _intern(u) for u in primary_reviewers)
+
+    def __getitem__(self, column):
+        if column not in self.__slots__:
+            raise KeyError(column)
+        value = getattr(self, column)
+        if column in TIME_COLUMNS:
+            return EPOCH + timedelta(microseconds=value)
+        if column in LIST_COLUMNS:
+            return list(value)
+        return value
+
+    def get(self, column, default=None):
+        try:
+            return self[column]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return list(COLUMNS)
+
+    def _values(self):
+        return tuple(getattr(self, column) for column in COLUMNS)
+
+    def __eq__(self, other):
+        if not isinstance(other, ReviewRequest):
+            return NotImplemented
+        return self._values() == other._values()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'ReviewRequest({!r})'.format(dict(self))
+
+
+class ReviewRequestStore(object):
+    """SQLite store holding one row per review request
+
+    All search views (my, to_me, user) read from the same table, so a
+    request is stored once no matter how many views it shows up in.
+    Each view remembers its own sync state, see ``sync_state``.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(
+            path, detect_types=sqlite3.PARSE_DECLTYPES)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+        self.fts = self._create_fts()
+
+    def _create_fts(self):
+        """Create the summary full-text index, return the module of the
+        index or None if there is none
+
+        The index is a separate table whose rowid is the review request id.
+        It is filled from review_requests when first created, so stores
+        written before the index existed are indexed too.
+        """
+        exists = self.conn.execute(
+            "SELECT sql FROM sqlite_master WHERE name = 'summary_fts'"
+        ).fetchone()
+        if exists:
+            return re.search(r'USING (\w+)', exists[0]).group(1).lower()
+        for module in FTS_MODULES:
+            try:
+                with self.conn:
+                    self.conn.execute(
+                        'CREATE VIRTUAL TABLE summary_fts '
+                        'USING {}(summary)'.format(module))
+                    self.conn.execute(
+                        'INSERT INTO summary_fts (rowid, summary) '
+                        'SELECT id, summary FROM review_requests')
+                return module
+            except sqlite3.OperationalError:  # module not compiled in
+                continue
+        return None
+
+    def close(self):
+        self.conn.close()
+
+    def version(self):
+        """Return a number that changes whenever ``save`` writes review
+        requests
+        """
+        return self.conn.execute('PRAGMA user_version').fetchone()[0]
+
+    @staticmethod
+    def _column_values(row):
+        return [','.join(row[col]) if col in LIST_COLUMNS else row[col]
+                for col in COLUMNS]
+
+    def _stored_values(self, ids):
+        """Return ``{id: column values}`` of the stored requests among
+        ``ids``
+        """
+        stored = {}
+        # below SQLite's limit of 999 parameters
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            for row in self.conn.execute(
+                    'SELECT {} FROM review_requests WHERE id IN ({})'.format(
+                        ', '.join(COLUMNS), ', '.join('?' * len(chunk))),
+                    chunk):
+                stored[row['id']] = list(row)
+        return stored
+
+    def save(self, rows):
+        """Insert or replace the given review requests. Requests stored
+        unchanged are skipped.
+        """
+        rows = list(rows)
+        stored = self._stored_values([row['id'] for row in rows])
+        written = False
+        with self.conn:
+            for row in rows:
+                values = self._column_values(row)
+                if stored.get(row['id']) == values:
+                    continue
+                written = True
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO review_requests ({}) '
+                    'VALUES ({})'.format(
+                        ', '.join(COLUMNS), ', '.join('?' * len(COLUMNS))),
+                    values)
+                self.conn.execute(
+                    'DELETE FROM target_people WHERE request_id = ?',
+                    (row['id'],))
+                self.conn.executemany(
+                    'INSERT OR IGNORE INTO target_people '
+                    '(username, request_id) VALUES (?, ?)',
+                    [(user, row['id']) for user in row['target_people']])
+                if self.fts:
+                    self.conn.execute(
+                        'DELETE FROM summary_fts WHERE rowid = ?',
+                        (row['id'],))
+                    self.conn.execute(
+                        'INSERT INTO summary_fts (rowid, summary) '
+                        'VALUES (?, ?)', (row['id'], row['summary']))
+        # unchanged rows keep the columnar snapshot valid
+        if written:
+            self._bump_version()
+
+    def _bump_version(self):
+        # bumped after the rows are committed, so a reader seeing the new
+        # version always sees the new rows too
+        self.conn.execute('PRAGMA user_version = {}'.format(
+            (self.version() + 1) % 2 ** 31))
+
+    def delete(self, ids):
+        """Remove the review requests ``ids``, e.g. deleted ones"""
+        if not ids:
+            return
+        with self.conn:
+            for id in ids:
+                self.conn.execute(
+                    'DELETE FROM review_requests WHERE id = ?', (id,))
+                self.conn.execute(
+                    'DELETE FROM target_people WHERE request_id = ?', (id,))
+                if self.fts:
+                    self.conn.execute(
+                        'DELETE FROM summary_fts WHERE rowid = ?', (id,))
+        self._bump_version()
+
+    def remove_target(self, username, ids):
+        """Take ``username`` out of the target_people of the review
+        requests ``ids``, e.g. after being removed as their reviewer
+        """
+        if not ids:
+            return
+        with self.conn:
+            for id in ids:
+                row = self.conn.execute(
+                    'SELECT target_people FROM review_requests WHERE id = ?',
+                    (id,)).fetchone()
+                if row is None:
+                    continue
+                people = [user for user in row[0].split(',')
+                          if user and user != username]
+                self.conn.execute(
+                    'UPDATE review_requests SET target_people = ? '
+                    'WHERE id = ?', (','.join(people), id))
+                self.conn.execute(
+                    'DELETE FROM target_people '
+                    'WHERE username = ? AND request_id = ?', (username, id))
+        self._bump_version()
+
+    def requests(self, submitter=None, target=None, terms=None,
+                 status=None, repo=None, updated_since=None,
+                 updated_before=None):
+        """Return ReviewRequests, newest first
+
+        :param submitter: only requests submitted by this user
+        :param target: only requests with this user in target_people
+        :param terms: only requests whose summary has words starting with
+            every word of these search terms (ignored without a
+            full-text index)
+        :param status: only requests with this status
+        :param repo: only requests on this repository
+        :param updated_since: only requests last updated at or after this
+            datetime
+        :param updated_before: only requests last updated before this
+            datetime
+        """
+        where = []
+        params = []
+        match = self._fts_query(terms or [])
+        if match:
+            where.append(
+                'id IN (SELECT rowid FROM summary_fts '
+                'WHERE summary_fts MATCH ?)')
+            params.append(match)
+        for column, value in [('submitter', submitter),
+                              ('status', status),
+                              ('repo', repo)]:
+            if value is not None:
+                where.append('{} = ?'.format(column))
+                params.append(value)
+        if updated_since is not None:
+            where.append('last_updated >= ?')
+            params.append(updated_since)
+        if updated_before is not None:
+            where.append('last_updated < ?')
+            params.append(updated_before)
+        if target is not None:
+            where.append(
+                'id IN (SELECT request_id FROM target_people '
+                'WHERE username = ?)')
+            params.append(target)
+
+        sql = 'SELECT {} FROM review_requests'.format(', '.join(COLUMNS))
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY last_updated DESC'
+        return [self._to_request(row)
+                for row in self.conn.execute(sql, params)]
+
+    def _fts_query(self, terms):
+        if not self.fts:
+            return None
+        words = [word for term in terms for word in re.findall(
+            r'\w+', term, re.UNICODE)]
+        # prefix queries: "word"* in FTS5, "word*" in FTS4
+        if self.fts == 'fts5':
+            pattern = '"{}"*'
+        else:
+            pattern = '"{}*"'
+        return ' '.join(pattern.format(word) for word in words)
+
+    @staticmethod
+    def _to_request(row):
+        values = dict(zip(row.keys(), row))
+        for col in LIST_COLUMNS:
+            values[col] = values[col].split(',') if values[col] else []
+        return ReviewRequest(**values)
+
+    def sync_state(self, query):
+        """Return ``(last_updated, synced_at)`` of the last complete sync
+        of ``query``; ``(None, 0)`` if it was never synced.
+        """
+        row = self.conn.execute(
+            'SELECT last_updated, synced_at FROM sync_state WHERE query = ?',
+            (query,)).fetchone()
+        if row is None:
+            return None, 0
+        return row['last_updated'], row['synced_at']
+
+    def set_sync_state(self, query, last_updated, full=False):
+        """Record a complete sync of ``query`` up to ``last_updated``;
+        ``full`` if it fetched the whole view, see ``full_synced_at``
+        """
+        now = time.time()
+        with self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO sync_state '
+                '(query, last_updated, synced_at) VALUES (?, ?, ?)',
+                (query, last_updated, now))
+            if full:
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO full_sync (query, synced_at) '
+                    'VALUES (?, ?)', (query, now))
+            self.conn.execute(
+                'DELETE FROM sync_attempt WHERE query = ?', (query,))
+
+    def full_synced_at(self, query):
+        """Return when ``query`` was last synced completely without a
+        high-water mark, 0 if never
+        """
+        row = self.conn.execute(
+            'SELECT synced_at FROM full_sync WHERE query = ?',
+            (query,)).fetchone()
+        return row[0] if row else 0
+
+    def sync_attempt(self, query):
+        """Return ``(attempted_at, failures)``: when the last sync of
+        ``query`` started and how many syncs in a row did not complete
+        since the last complete one; ``(0, 0)`` if there were none.
+        """
+        row = self.conn.execute(
+            'SELECT attempted_at, failures FROM sync_attempt '
+            'WHERE query = ?', (query,)).fetchone()
+        if row is None:
+            return 0, 0
+        return row['attempted_at'], row['failures']
+
+    def start_sync(self, query):
+        """Record that a sync of ``query`` starts now. It counts as
+        failed until ``set_sync_state`` records it complete.
+        """
+        with self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO sync_attempt '
+                '(query, attempted_at, failures) VALUES (?, ?, '
+                'COALESCE((SELECT failures FROM sync_attempt '
+                'WHERE query = ?), 0) + 1)',
+                (query, time.time(), query))
@@ -0,0 +1,93 @@
+"""Keep review request views synced ahead of the searches that need them
+
+The scheduler runs as the background job ``prefetch`` (see
+``RBFlow.prefetch``). Every view is synced once per ``interval`` seconds,
+so a view is never older than SYNC_INTERVAL when searched and the search
+is answered from the local store. Each view's next sync is shifted by up
+to ``jitter`` of the interval, so views synced together drift apart and
+don't hit the server at the same moment. After a failed sync a view is
+retried after ``backoff`` seconds, doubled on every further failure up to
+``max_backoff``.
+
+Views are synced one at a time through a single RBWrapper, so all of
+them share its page workers and rate limit.
+"""
+import random
+import time
+
+
+class Scheduler(object):
+
+    def __init__(self, sync, interval, jitter=0.1, backoff=60,
+                 max_backoff=3600, logger=None, clock=time.time,
+                 sleep=time.sleep):
+        """``sync(view)`` syncs one view and returns whether it synced
+        completely; exceptions count as failures too.
+        """
+        self.sync = sync
+        self.interval = interval
+        self.jitter = jitter
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.logger = logger
+        self.clock = clock
+        self.sleep = sleep
+        self.due = {}
+        self.failures = {}
+
+    def _next(self, start):
+        spread = self.interval * self.jitter
+        return start + self.interval + random.uniform(-spread, spread)
+
+    def schedule(self, views, synced_at):
+        """Track ``views``, dropping views no longer among them. A new
+        view is due one interval after ``synced_at(view)``, its last
+        sync time (0 if never synced).
+        """
+        for view in list(self.due):
+            if view not in views:
+                del self.due[view]
+                self.failures.pop(view, None)
+        for view in views:
+            if view not in self.due:
+                self.due[view] = self._next(synced_at(view))
+
+    def run_due(self):
+        """Sync every view that is due, oldest first. Return the number
+        of seconds until the next one is due.
+        """
+        for view in sorted(self.due, key=self.due.get):
+            now = self.clock()
+            if self.due[view] > now:
+                continue
+            try:
+                synced, error = self.sync(view), 'incomplete'
+            except Exception as e:
+                synced, error = False, e
+            if not synced:
+                failures = self.failures.get(view, 0) + 1
+                self.failures[view] = failures
+                delay = min(
+                    self.max_backoff, self.backoff * 2 ** (failures - 1))
+                self.due[view] = now + delay
+                if self.logger is not None:
+                    self.logger.warning(
+                        'prefetch %s failed (%s), retrying in %ds',
+                        view, error, delay)
+            else:
+                self.failures.pop(view, None)
+                self.due[view] = self._next(self.clock())
+        if not self.due:
+            return self.interval
+        return max(0, min(self.due.values()) - self.clock())
+
+    def run(self, views, synced_at, poll=60):
+        """Sync ``views()``, looking for new views at least every
+        ``poll`` seconds, until it returns None.
+        """
+        while True:
+            current = views()
+            if current is None:
+                return
+            self.schedule(current, synced_at)
+            self.sleep(min(poll, self.run_due()))
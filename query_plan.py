@@ -0,0 +1,187 @@
+"""Plan how ``column=value`` / ``column~value`` / ``column>value`` /
+``column<value`` search filters are applied
+
+Filters typed after a search keyword are split three ways:
+
+* equality on an indexed column of the local store (status, submitter,
+  repo) and ranges of last_updated become part of the SQL query, see
+  ``ReviewRequestStore.requests``, and of the columnar snapshot scan,
+  see ``ReviewRequestColumns.select``
+* everything else is checked row by row, most selective filter first
+* filters on columns review requests don't have, and numbers or dates
+  that aren't, are reported back instead of failing the search
+
+Values are typed text, compared per column type: ``=`` on a number
+column compares numbers, on a date column (time_added, last_updated)
+it matches dates starting with the value, e.g. ``last_updated=2020-05``,
+and on a list column (target_people, primary_reviewers) it matches if
+the value is one of the list. ``~`` matches if the value is part of the
+text of the column, or of any list item; dates read
+``YYYY-MM-DD HH:MM:SS``. ``>`` and ``<`` compare number and date
+columns: ``last_updated>2020-05`` keeps the requests updated since the
+start of May 2020, ``last_updated<2020-05`` those updated before it.
+
+Equality on status and submitter, and last_updated ranges, can also
+narrow the server-side ``get_review_requests`` query (see
+``QueryPlan.server``), which the search uses for a one-off fetch when a
+view was never synced; the view itself is always synced unfiltered.
+Repositories are filtered by id on the server, so ``repo=`` is only
+applied locally.
+"""
+from datetime import datetime
+
+from cr_store import COLUMNS
+from cr_store import INDEXED_COLUMNS
+from cr_store import INT_COLUMNS
+from cr_store import LIST_COLUMNS
+from cr_store import TIME_COLUMNS
+from rb_wrapper import TIME_FORMAT as SERVER_TIME_FORMAT
+
+# server-side review request list filter of each column
+SERVER_FILTERS = {
+    'status': 'status',
+    'submitter': 'from_user',
+}
+# ``requests`` / ``select`` argument and server-side filter of each
+# last_updated range operator
+RANGE_FILTERS = {
+    '>': ('updated_since', 'last_updated_from'),
+    '<': ('updated_before', 'last_updated_to'),
+}
+# text of TIME_COLUMNS values that filters are compared with
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+# date values ``>`` and ``<`` accept, longest first; a space would end
+# the filter, so a time follows a 'T'
+DATE_FORMATS = ['%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d', '%Y-%m',
+                '%Y']
+
+
+def parse_date(value):
+    """Return the start of the date ``value``, e.g. ``2020-05`` for
+    2020-05-01 00:00; ValueError if it isn't one of DATE_FORMATS
+    """
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+    raise ValueError('Not a date: {}'.format(value))
+
+
+def _texts(column, value):
+    """Return the texts of row value ``value`` of ``column`` that ``~``
+    looks for the filter value in
+    """
+    if value is None:  # e.g. a request without repository
+        return []
+    if column in LIST_COLUMNS:
+        return value
+    if column in TIME_COLUMNS:
+        return [value.strftime(TIME_FORMAT)]
+    if column in INT_COLUMNS:
+        return [str(value)]
+    return [value]
+
+
+def _test(column, operator, value):
+    """Return a function telling whether a row value of ``column``
+    matches the filter. Raises ValueError for ``=``, ``>`` or ``<`` on a
+    number column with a value that isn't one, for ``>`` or ``<`` on a
+    date column with a value that isn't one, and for ``>`` or ``<`` on
+    any other column.
+    """
+    if operator == '~':
+        return lambda v: any(value in text for text in _texts(column, v))
+    if operator in '<>':
+        if column in INT_COLUMNS:
+            bound = int(value)
+            if operator == '>':
+                return lambda v: v > bound
+        elif column in TIME_COLUMNS:
+            # a date is a period, which ``>`` keeps
+            bound = parse_date(value)
+            if operator == '>':
+                return lambda v: v >= bound
+        else:
+            raise ValueError('{} has no order'.format(column))
+        return lambda v: v < bound
+    if column in INT_COLUMNS:
+        number = int(value)
+        return lambda v: v == number
+    if column in TIME_COLUMNS:
+        return lambda v: v.strftime(TIME_FORMAT).startswith(value)
+    if column in LIST_COLUMNS:
+        return lambda v: value in v
+    return lambda v: v == value
+
+
+class QueryPlan(object):
+
+    def __init__(self, extra_filter):
+        """Plan the filters ``{column: (operator, value)}`` returned by
+        RBFlow._parse_filters.
+        """
+        self.where = {}
+        self.server = {}
+        self.unknown = []
+        # (column, operator, value) of values the column can't hold
+        self.invalid = []
+        predicates = []
+        for column, (operator, value) in sorted(extra_filter.items()):
+            if column not in COLUMNS:
+                self.unknown.append(column)
+                continue
+            try:
+                if operator == '=' and column in INDEXED_COLUMNS:
+                    self.where[column] = value
+                    if column in SERVER_FILTERS:
+                        self.server[SERVER_FILTERS[column]] = value
+                    continue
+                if column == 'last_updated' and operator in RANGE_FILTERS:
+                    argument, server_filter = RANGE_FILTERS[operator]
+                    self.where[argument] = parse_date(value)
+                    self.server[server_filter] = self.where[
+                        argument].strftime(SERVER_TIME_FORMAT)
+                    continue
+                test = _test(column, operator, value)
+            except ValueError:
+                self.invalid.append((column, operator, value))
+                continue
+            predicates.append((column, operator, value, test))
+        predicates.sort(key=self._selectivity)
+        self.predicates = [predicate[:3] for predicate in predicates]
+        self._tests = [(column, test) for column, _, _, test in predicates]
+
+    @staticmethod
+    def _selectivity(predicate):
+        """Sort key putting the predicates that reject most rows first:
+        equality before substring, longer substrings before shorter ones.
+        """
+        column, operator, value = predicate[:3]
+        return (operator != '=', -len(value))
+
+    def merge_where(self, where):
+        """Return ``where`` (keyword arguments of
+        ReviewRequestStore.requests) with the indexed filters added, or
+        None if they contradict it.
+        """
+        merged = dict(where)
+        for column, value in self.where.items():
+            if merged.get(column, value) != value:
+                return None
+            merged[column] = value
+        return merged
+
+    def matches(self, row):
+        for column, test in self._tests:
+            if not test(row[column]):
+                return False
+        return True
+
+    def filter(self, rows):
+        """Return the rows matching the filters that are not pushed down
+        to the store
+        """
+        if not self.predicates:
+            return rows
+        return [row for row in rows if self.matches(row)]
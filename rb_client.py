@@ -0,0 +1,66 @@
+# encoding: utf-8
+"""Script filter entry point that asks the resident daemon (rb_daemon.py)
+
+Only the standard library needed to talk to the socket is imported here.
+If the daemon is not running, is busy, e.g. syncing a view, or exits
+while the query is sent, the query is answered by reviewboard.py in this
+process instead.
+"""
+import json
+import os
+import socket
+import sys
+
+# seconds to wait for the daemon's answer, which takes milliseconds unless
+# it is syncing; running the query here takes a fraction of a second more
+QUERY_TIMEOUT = 1.0
+
+
+def socket_path():
+    return os.path.join(
+        os.environ.get('TMPDIR', '/tmp'), 'alfred-reviewboard.sock')
+
+
+def query(argv):
+    """Send ``argv`` and the Alfred session to the daemon and return its
+    feedback.
+
+    Raises socket.error if no daemon is listening or it did not answer
+    within QUERY_TIMEOUT (socket.timeout).
+    """
+    message = {
+        'argv': argv,
+        'session_id': os.environ.get('_WF_SESSION_ID'),
+    }
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(QUERY_TIMEOUT)
+    try:
+        sock.connect(socket_path())
+        sock.sendall(json.dumps(message) + '\n')
+        sock.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return ''.join(chunks)
+    finally:
+        sock.close()
+
+
+def main():
+    try:
+        output = query(sys.argv[1:])
+    except socket.error:
+        output = None
+    if not output:
+        import reviewboard
+        return reviewboard.main()
+    sys.stdout.write(output)
+    sys.stdout.flush()
+    return 0
+
+
+if __name__ == u"__main__":
+    sys.exit(main())
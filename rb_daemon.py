@@ -0,0 +1,75 @@
+# encoding: utf-8
+"""Long-lived process answering script filter queries sent by rb_client.py
+
+Keeping RBFlow alive means interpreter startup, imports, the user
+directory and the review request store are loaded once instead of on
+every keystroke. Only the workflow settings are read again for every
+query, as the settings window and other runs may change them. The daemon
+exits after ``daemon_idle_timeout`` seconds without a query, or after
+answering one once ``daemon`` is turned off.
+"""
+import json
+import os
+import socket
+import sys
+from cStringIO import StringIO
+
+from rb_client import socket_path
+from reviewboard import RBFlow
+
+
+def handle(flow, conn):
+    """Run the query read from ``conn`` and write back its feedback"""
+    request = conn.makefile('rb')
+    message = json.loads(request.readline())
+    request.close()
+
+    sys.argv = ['reviewboard.py'] + message['argv']
+    # the session belongs to the Alfred invocation, not to the daemon
+    flow.wf.reset(message.get('session_id'))
+    flow.wf.reload_settings()
+    stdout = sys.stdout
+    sys.stdout = output = StringIO()
+    try:
+        flow.wf.run(flow.main)
+    except SystemExit:  # magic arguments exit after their feedback
+        pass
+    finally:
+        sys.stdout = stdout
+    conn.sendall(output.getvalue())
+
+
+def serve(flow):
+    path = socket_path()
+    if os.path.exists(path):
+        os.unlink(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(5)
+    flow.wf.logger.debug('daemon listening on %s', path)
+    try:
+        while flow.wf.settings['daemon']:
+            server.settimeout(flow.wf.settings['daemon_idle_timeout'])
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                break
+            try:
+                conn.settimeout(None)
+                handle(flow, conn)
+            except Exception as e:
+                flow.wf.logger.exception(e)
+            finally:
+                conn.close()
+    finally:
+        server.close()
+        os.unlink(path)
+    flow.wf.logger.debug('daemon idle or turned off, exiting')
+
+
+if __name__ == u"__main__":
+    flow = RBFlow()
+    flow.resident = True
+    # the NumPy filter arrays are only reused in a resident process
+    flow.wf.batch_filter = True
+    serve(flow)
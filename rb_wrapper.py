@@ -1,89 +1,430 @@
-# We need to import workflow so that it is able to find the lib/
+import json
 import os
+import sys
+import threading
 import time
 from datetime import datetime
+from itertools import chain
+from operator import attrgetter
 
-from workflow import Workflow
+from cr_store import ReviewRequest
+from workflow.workflow import LockFile
+from workflow.workflow import atomic_writer
+
+# rbtools is bundled in lib/. It is only imported once a client is needed,
+# so searches answered from the local store never load it.
+LIB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib')
+if LIB_DIR not in sys.path:
+    sys.path.insert(0, LIB_DIR)
+
+PAGE_SIZE = 200
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+ROOT_MIME_TYPE = 'application/vnd.reviewboard.org.root+json'
+# fields and links of list items read by RBWrapper, requested through
+# only-fields / only-links. Link titles are part of the item, so the
+# linked resources never need to be fetched or expanded.
+REVIEW_REQUEST_FIELDS = [
+    'id', 'summary', 'time_added', 'last_updated', 'ship_it_count',
+    'status', 'issue_open_count', 'target_people', 'absolute_url',
+    'extra_data']
+REVIEW_REQUEST_LINKS = ['submitter', 'repository']
+USER_FIELDS = ['username', 'fullname', 'avatar_url']
+
+
+class FetchTimeout(Exception):
+    """Raised when not every page arrived before the deadline.
+
+    ``partial`` holds the rows of the leading pages that did arrive,
+    in their original order.
+    """
+
+    def __init__(self, partial):
+        super(FetchTimeout, self).__init__(
+            'Deadline exceeded after {} rows'.format(len(partial)))
+        self.partial = partial
+
+
+class RateLimiter(object):
+    """Token bucket shared by the threads fetching pages
+
+    Up to ``burst`` requests may start at once, after which requests are
+    spread out to ``rate`` per second. A ``rate`` of None disables it.
+    """
+
+    def __init__(self, rate=None, burst=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent"""
+        if self.rate is None:
+            return
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(
+                    self.burst,
+                    self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
 
-Workflow(libraries=['./lib'])
-from rbtools.api.client import RBClient
 
 class RBWrapper(object):
 
-    def __init__(self, user, password, url):
+    def __init__(self, user, password, url, max_workers=4, timeout=None,
+                 root_cache=None, root_ttl=86400, rate=None,
+                 select_fields=True, http_cache=None):
+        """``password`` may be a callable returning it, which is only
+        called when the first client is created, e.g. to read it from the
+        Keychain only if the server is actually contacted.
+        """
         if any(v is None for v in [url, user, password]):
             raise ValueError("Unable to login,'{}', '{}', '{}']".format(
                 user, password, url))
         self.user = user
         self.url = url
-        self.client = RBClient(url, username=user, password=password)
+        self.max_workers = max(1, max_workers)
+        self.timeout = timeout
+        self.limiter = RateLimiter(rate, burst=self.max_workers)
+        self.root_cache = root_cache
+        self.root_ttl = root_ttl
+        self._password = password
+        self._password_lock = threading.Lock()
+        self._local = threading.local()
+        self._root_payload = None
+        self._http_cache_lock = threading.Lock()
+        self._http_cache_ready = False
+        # cleared once the server rejects only-fields / only-links
+        self.select_fields = select_fields
+        self.http_cache = http_cache
+
+    @property
+    def client(self):
+        """RBClient of the current thread
+
+        With ``http_cache``, every GET response is stored in that SQLite
+        file with its ETag / Last-Modified validators, keyed by URL, page
+        query included. Requesting the URL again sends If-None-Match /
+        If-Modified-Since, and a 304 answer is served from the file, so
+        an unchanged page costs a round trip but no body. Whether the last
+        response of the thread came from the file is kept in
+        ``self._local.reused``, see _fetch_list.
+        """
+        # RBClient keeps a cookie jar and an API cache connection that
+        # must not be shared between threads, so every thread gets its own.
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            from rbtools.api.client import RBClient
+            options = {}
+            if self.http_cache is not None:
+                self._create_http_cache()
+                options.update(
+                    allow_caching=True, in_memory_cache=False,
+                    cache_location=self.http_cache)
+            client = RBClient(
+                self.url, username=self.user, password=self.password,
+                **options)
+            self._track_reuse(client)
+            self._local.client = client
+        return client
+
+    def _create_http_cache(self):
+        """Create the tables of ``http_cache`` unless they exist
+
+        Every client opens its own connection to the file once the API
+        root is loaded, and creates the tables if they are missing. When
+        clients do so at once, on the threads of one process or in
+        overlapping processes, all but one fail with CacheError ("no such
+        table: cache_info"), so the tables are created here first, under
+        a lock file.
+        """
+        with self._http_cache_lock:
+            if self._http_cache_ready:
+                return
+            from rbtools.api.cache import APICache
+            with LockFile(self.http_cache):
+                cache = APICache(db_location=self.http_cache)
+                if cache.db is not None:
+                    cache.db.close()
+            self._http_cache_ready = True
+
+    def _track_reuse(self, client):
+        """Record in ``self._local.reused`` whether the response to the
+        last request of ``client`` came from ``http_cache``, either still
+        fresh or revalidated by a 304
+        """
+        from rbtools.api.cache import CachedHTTPResponse
+        server = client._transport.server
+        make_request = server.make_request
+
+        def _make_request(request):
+            rsp = make_request(request)
+            self._local.reused = isinstance(rsp, CachedHTTPResponse)
+            return rsp
+        server.make_request = _make_request
+
+    @property
+    def password(self):
+        with self._password_lock:
+            if callable(self._password):
+                self._password = self._password()
+        if self._password is None:
+            raise ValueError("Unable to login, no password for '{}'".format(
+                self.user))
+        return self._password
 
     @property
     def root(self):
-        return self.client.get_root()
+        """The API root resource, fetched at most once per ``root_ttl``
+
+        The root only holds the URI templates, so its payload is kept in
+        memory and in the ``root_cache`` file, shared by every process.
+        That file is ignored once it is older than ``root_ttl`` seconds or
+        was written for another server or user.
+        """
+        root = getattr(self._local, 'root', None)
+        if root is not None:
+            return root
+
+        if self._root_payload is None:
+            self._root_payload = self._load_root_payload()
+        if self._root_payload is None:
+            root = self.client.get_root()
+            self._root_payload = root.rsp
+            self._save_root_payload(root.rsp)
+        else:
+            from rbtools.api.factory import create_resource
+            root = create_resource(
+                self.client._transport,
+                self._root_payload,
+                self._root_payload['links']['self']['href'],
+                mime_type=ROOT_MIME_TYPE)
+        self._local.root = root
+        return root
+
+    def _load_root_payload(self):
+        if self.root_cache is None or not os.path.exists(self.root_cache):
+            return None
+        if time.time() - os.stat(self.root_cache).st_mtime >= self.root_ttl:
+            return None
+        try:
+            with open(self.root_cache) as f:
+                cached = json.load(f)
+        except ValueError:
+            return None
+        if cached.get('url') != self.url or cached.get('user') != self.user:
+            return None
+        return cached['payload']
+
+    def _save_root_payload(self, payload):
+        if self.root_cache is None:
+            return
+        with atomic_writer(self.root_cache, 'w') as f:
+            json.dump(
+                {'url': self.url, 'user': self.user, 'payload': payload}, f)
+
+    def _fetch_pages(self, fetch_page, starts, deadline=None):
+        """Call ``fetch_page(start)`` for every start, at most
+        ``max_workers`` at a time, and return the pages in order.
+
+        Raise FetchTimeout with the rows fetched so far if ``deadline``
+        (a ``time.time()`` value) passes first. With a deadline, pages are
+        always fetched on worker threads, so a request that hangs can be
+        given up on; the thread is left to finish on its own.
+        """
+        def _remaining():
+            if deadline is None:
+                return None
+            return max(deadline - time.time(), 0)
+
+        pages = []
+        if not starts:
+            return pages
+        if deadline is None and (self.max_workers == 1 or len(starts) == 1):
+            for start in starts:
+                pages.append(fetch_page(start))
+            return pages
+
+        from multiprocessing import TimeoutError
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(self.max_workers, len(starts)))
+        try:
+            pending = [pool.apply_async(fetch_page, (start,))
+                       for start in starts]
+            for result in pending:
+                try:
+                    pages.append(result.get(_remaining()))
+                except TimeoutError:
+                    raise FetchTimeout(list(chain.from_iterable(pages)))
+        finally:
+            pool.terminate()
+        return pages
+
+    def _deadline(self, timeout):
+        if timeout is None:
+            timeout = self.timeout
+        return None if timeout is None else time.time() + timeout
+
+    def _fetch_list(self, resource, build, total=None, deadline=None,
+                    skip_reused=False, **filters):
+        """Return ``build(item)`` for every item of the list ``resource``
+        (as in ``root.get_<resource>``), in server order.
+
+        The first page also tells the total (unless ``total`` is given),
+        the remaining pages are then requested concurrently. Every request
+        goes through ``limiter``. ``deadline`` bounds all of them, the
+        first page and the API root included.
+
+        With ``skip_reused``, pages the server answered with 304 Not
+        Modified (or still fresh in ``http_cache``) are left out: their
+        items are the ones the same request returned last time.
+        """
+        def _get_page(start):
+            self.limiter.acquire()
+            return getattr(self.root, 'get_' + resource)(
+                start=start, max_results=PAGE_SIZE, **filters)
+
+        def _build(page):
+            if skip_reused and getattr(self._local, 'reused', False):
+                return []
+            return map(build, page)
+
+        def _fetch_page(start):
+            return _build(_get_page(start))
+
+        def _fetch_first(start):
+            page = _get_page(start)
+            return _build(page), page.total_results, len(page)
+
+        first, start = [], 0
+        if total is None:
+            [(first, total, start)] = self._fetch_pages(
+                _fetch_first, [0], deadline)
+
+        try:
+            pages = self._fetch_pages(
+                _fetch_page, range(start, total, PAGE_SIZE), deadline)
+        except FetchTimeout as e:
+            raise FetchTimeout(first + e.partial)
+        return first + list(chain.from_iterable(pages))
+
+    def _fetch_selected(self, resource, build, fields, links, total=None,
+                        deadline=None, skip_reused=False, **filters):
+        """Like _fetch_list, but only request ``fields`` and ``links``
+        of the items, which shrinks every page considerably.
+
+        Servers older than Review Board 2.0 ignore these arguments. If a
+        server rejects them instead, the list is fetched in full and they
+        are not sent again.
+        """
+        if self.select_fields:
+            from rbtools.api.errors import APIError
+            try:
+                return self._fetch_list(
+                    resource, build, total, deadline, skip_reused,
+                    only_fields=','.join(fields),
+                    only_links=','.join(links), **filters)
+            except APIError as e:
+                if e.http_status != 400:
+                    raise
+                self.select_fields = False
+        return self._fetch_list(
+            resource, build, total, deadline, skip_reused, **filters)
 
     def get_user_lists(self):
         """Return dict of all users, dict key is user handle, and value
         is a dict containing 'username', 'fullname' and 'avatar_url'
         """
-        count = self.root.get_users(counts_only=True).count
-        users = {}
-        user_columns = ['username', 'fullname', 'avatar_url']
-        for start in range(1, count + 1, 200):
-            for user in self.root.get_users(start=start, max_results=200):
-                users[user['username']] = {
-                    col: getattr(user, col) for col in user_columns}
-            time.sleep(1)
-        return users
-
-    def search(self, total=None, **filters):
+        users = self._fetch_selected(
+            'users',
+            lambda user: {col: getattr(user, col) for col in USER_FIELDS},
+            USER_FIELDS, [])
+        return {user['username']: user for user in users}
+
+    def search(self, total=None, timeout=None, skip_reused=False,
+               **filters):
         """search list of reviews based on the given filters
 
+        Pages are requested concurrently (see ``max_workers``) and merged
+        back in server order. If ``timeout`` seconds (default:
+        ``self.timeout``) pass before every page arrived, FetchTimeout is
+        raised. ``skip_reused`` leaves out unchanged pages, see
+        _fetch_list.
+
         for available filters:
         https://www.reviewboard.org/docs/manual/dev/webapi/2.0/resources/
         review-request-list/#webapi2.0-review-request-list-resource
         """
         def _parse_time(t):
-            return datetime.strptime(t, '%Y-%m-%dT%H:%M:%SZ')
-
-        def _build_request_dict(request):
-            return {
-                'id': request.id,
-                'summary': request.summary,
-                'time_added': _parse_time(request.time_added),
-                'last_updated': _parse_time(request.last_updated),
-                'ship_it_count': request.ship_it_count,
-                'status': request.status,
-                'submitter': request.links.submitter.title,
-                'issue_open_count': request.issue_open_count,
-                'repo': request.links.repository.title,
-                'target_people': [p.title for p in request.target_people],
-                'absolute_url': request.absolute_url,
-                'primary_reviewers': sorted([
+            return datetime.strptime(t, TIME_FORMAT)
+
+        def _build_request(request):
+            return ReviewRequest(
+                id=request.id,
+                summary=request.summary,
+                time_added=_parse_time(request.time_added),
+                last_updated=_parse_time(request.last_updated),
+                ship_it_count=request.ship_it_count,
+                status=request.status,
+                submitter=request.links.submitter.title,
+                issue_open_count=request.issue_open_count,
+                repo=request.links.repository.title,
+                target_people=[p.title for p in request.target_people],
+                absolute_url=request.absolute_url,
+                primary_reviewers=sorted([
                     u.strip()
                     for u in getattr(
                         request.extra_data, 'primary_reviewers', ''
                     ).split(',')
                     if u.strip() != ''],
-                    key=lambda name: name != self.user)
-                }
-        if total is None:
-            total = self.root.get_review_requests(
-                counts_only=True,
-                **filters
-            ).count
-
-        result = []
-        for start in range(1, total, 200):
-            result.extend(
-                map(
-                    _build_request_dict,
-                    self.root.get_review_requests(
-                        start=start, max_results=200, **filters
-                    )
-                )
-            )
-        return result
+                    key=lambda name: name != self.user))
+
+        return self._fetch_selected(
+            'review_requests', _build_request,
+            REVIEW_REQUEST_FIELDS, REVIEW_REQUEST_LINKS, total,
+            self._deadline(timeout), skip_reused, **filters)
+
+    def sync(self, rows, since=None, skip_reused=False, **filters):
+        """Merge review requests changed since ``since`` into ``rows``
+
+        ``since`` is the high-water mark returned by the previous sync; only
+        requests with ``last_updated`` at or after it are fetched (all of
+        them if it is None). Rows are merged by id, newest first.
+
+        While nothing changes, the mark stays put and every sync sends the
+        same requests. With ``skip_reused``, pages answered with 304 Not
+        Modified are neither parsed nor merged, so a caller that stored
+        the rows of the previous sync need not store them again.
+
+        Returns ``(rows, since)`` with the advanced high-water mark. If the
+        fetch runs out of time, FetchTimeout is raised with the merged rows
+        and the mark is left where it was.
+        """
+        if since is not None:
+            filters['last_updated_from'] = since.strftime(TIME_FORMAT)
+
+        merged = {row['id']: row for row in rows}
+        try:
+            changed = self.search(skip_reused=skip_reused, **filters)
+        except FetchTimeout as e:
+            merged.update((row['id'], row) for row in e.partial)
+            raise FetchTimeout(self._newest_first(merged.values()))
+
+        merged.update((row['id'], row) for row in changed)
+        if changed:
+            since = max(row['last_updated'] for row in changed)
+        return self._newest_first(merged.values()), since
+
+    @staticmethod
+    def _newest_first(rows):
+        return sorted(rows, key=attrgetter('last_updated'), reverse=True)
 
     def search_cr_from(self, username=None, total=None):
         """shortcut for search cr from specific user
@@ -102,6 +443,25 @@ class RBWrapper(object):
             username = self.user
         return self.search(to_users_directly=username, status='all')
 
+    def sync_cr_from(self, rows, since=None, username=None, **filters):
+        """incremental version of search_cr_from, see sync
+
+        ``filters`` narrow the search further, e.g. ``status='pending'``
+        """
+        if username is None:
+            username = self.user
+        filters.setdefault('status', 'all')
+        filters['from_user'] = username
+        return self.sync(rows, since, **filters)
+
+    def sync_cr_to(self, rows, since=None, username=None, **filters):
+        """incremental version of search_cr_to, see sync"""
+        if username is None:
+            username = self.user
+        filters.setdefault('status', 'all')
+        filters['to_users_directly'] = username
+        return self.sync(rows, since, **filters)
+
     def get_user_cr_url(self, username=None):
         if username is None:
             username = self.user
@@ -2,26 +2,35 @@
 import argparse
 import os
 import re
-import subprocess
 import sys
 import time
-from operator import itemgetter
 from datetime import datetime
 
 from workflow import ICON_INFO
 from workflow import ICON_SETTINGS
+from workflow import ICON_SYNC
 from workflow import ICON_USER
+from workflow import ICON_WARNING
 from workflow import ICON_WEB
 from workflow import MATCH_CAPITALS
-from workflow import notify
 from workflow import Variables
-from workflow import web
-from workflow import Workflow
-from workflow.background import is_running
-from workflow.background import run_in_background
-
+from workflow import FilterIndex
+from workflow import Workflow3
+
+import cr_columns
+from cr_store import COLUMNS
+from cr_store import INT_COLUMNS
+from cr_store import ReviewRequestStore
+from cr_store import TIME_COLUMNS
+from cr_store import to_micros
+from query_plan import QueryPlan
+from rb_wrapper import FetchTimeout
 from rb_wrapper import RBWrapper
-from settings_window import open_settings
+import user_index
+
+# Alfred starts a new process for every keystroke, so modules only some
+# subcommands need (Tkinter, subprocess, notify, background) are imported
+# where they are used, and rb_wrapper loads rbtools on its first request.
 
 __version__ = '1.2.0'
 WF_CONFIG = {
@@ -31,27 +40,298 @@ WF_CONFIG = {
     'prereleases': '-beta' in __version__
 }
 LIMIT = 8
+# seconds after which a view of review requests is synced again
+SYNC_INTERVAL = 60 * 15
+# seconds before a failed sync is retried, doubled with every further
+# failure up to SYNC_INTERVAL
+SYNC_RETRY = 60
+# seconds after which a view is fetched whole again, dropping the requests
+# the server no longer returns for it (deleted, private, reviewer removed)
+FULL_SYNC_INTERVAL = 60 * 60 * 24
+# fields of a review request search terms can be matched against
+MATCH_FIELDS = ('summary', 'id', 'repo', 'submitter', 'target_people')
+# build a FilterIndex for resident processes from this many rows on
+INDEX_MIN_ROWS = 1000
+DEFAULT_SETTINGS = {
+    # number of review request pages fetched concurrently
+    'fetch_workers': 4,
+    # seconds a search may spend on the network before giving up
+    'fetch_timeout': 10,
+    # max page requests per second to the server, None for no limit
+    'fetch_rate': 5,
+    # only download the fields in use, turn off for servers rejecting
+    # only-fields / only-links
+    'select_fields': True,
+    # answer from stored review requests while a stale view syncs in the
+    # background, instead of waiting for the sync
+    'stale_while_revalidate': True,
+    # keep the my / to_me views and the views of the most recently
+    # searched users synced in the background, see prefetch.py
+    'prefetch': False,
+    # seconds between syncs of a view, below SYNC_INTERVAL so searches
+    # never find a view stale
+    'prefetch_interval': 600,
+    # number of recently searched users whose views are kept synced
+    'prefetch_users': 5,
+    # page requests the prefetch job may have in flight, for all views
+    'prefetch_workers': 2,
+    # answer searches from a resident process, see rb_daemon.py
+    'daemon': False,
+    # seconds without a query before the daemon exits
+    'daemon_idle_timeout': 600,
+    # weight of each of MATCH_FIELDS free-text search terms are matched
+    # against, missing fields are not matched
+    'match_fields': {'summary': 1},
+}
 
 
 class RBFlow(object):
 
     def __init__(self):
-        self.wf = Workflow(update_settings=WF_CONFIG, libraries=['./lib'])
+        self.wf = Workflow3(
+            default_settings=DEFAULT_SETTINGS,
+            update_settings=WF_CONFIG,
+            libraries=['./lib'])
+        # loads faster than cPickle, see benchmarks/serializers.py; caches
+        # and data stored as cPickle are converted when next read
+        self.wf.cache_serializer = 'marshal'
+        self.wf.data_serializer = 'marshal'
+        self._store = None
+        self._cr_columns = None
+        self._user_index = None
+        self._filter_keys = {}
+        self._summary_index = None
+        # set by rb_daemon.py, which keeps this object between queries
+        self.resident = False
 
     def get_login_info(self):
         login_info = self.wf.stored_data('login_info') or {}
-        try:
-            password = self.wf.get_password('review_board')
-        except:
-            password = None
         url = login_info.get('url', None)
         username = login_info.get('user', None)
-        return {'user': username, 'url': url, 'password': password}
+        return {'user': username, 'url': url, 'password': self.get_password()}
 
-    def get_rb_wrapper(self):
-        login_info = self.get_login_info()
+    def get_password(self):
+        try:
+            return self.wf.get_password('review_board')
+        except:
+            return None
+
+    def get_rb_wrapper(self, max_workers=None, background=False,
+                       login_info=None):
+        """Return an RBWrapper for the configured server, or the one of
+        ``login_info`` (see get_login_info). Its requests give up after
+        ``fetch_timeout`` seconds, unless it is for a ``background`` job,
+        which nobody waits for.
+
+        Without ``login_info`` the password is only read from the Keychain,
+        which runs /usr/bin/security, once the wrapper contacts the server;
+        searches answered from the local store never do.
+        """
+        if login_info is None:
+            stored = self.wf.stored_data('login_info') or {}
+            login_info = {
+                'user': stored.get('user', None),
+                'url': stored.get('url', None),
+                'password': self.get_password,
+            }
         return RBWrapper(
-            login_info['user'], login_info['password'], login_info['url'])
+            login_info['user'], login_info['password'], login_info['url'],
+            max_workers=max_workers or self.wf.settings['fetch_workers'],
+            timeout=None if background else self.wf.settings['fetch_timeout'],
+            root_cache=self.wf.cachefile('api_root.json'),
+            rate=self.wf.settings['fetch_rate'],
+            select_fields=self.wf.settings['select_fields'],
+            http_cache=self.wf.cachefile('http_cache.sqlite'))
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = ReviewRequestStore(
+                self.wf.cachefile('review_requests.sqlite'))
+        return self._store
+
+    def _run_in_background(self, name, args):
+        """Start job ``name`` unless it is already running"""
+        from workflow.background import is_running
+        from workflow.background import run_in_background
+        if not is_running(name):
+            run_in_background(name, args)
+
+    def _synced_crs(self, wrapper, query, search_terms, plan, **where):
+        """Return ``(rows, narrowed)``: the review requests from the
+        local store matching ``where`` (see ReviewRequestStore.requests)
+        and the indexed filters of QueryPlan ``plan``.
+
+        ``search_terms`` narrow the rows through the full-text index
+        first, and ``narrowed`` is True if they did. It only finds word
+        prefixes, so unless it fills all LIMIT results, all rows are
+        returned and the fuzzy filter also finds initials and words
+        containing the terms. The index only holds summaries, so it is
+        skipped when ``match_fields`` weighs other fields too.
+
+        Once the last complete sync of ``query`` is older than 15 minutes,
+        it is synced again (see sync_view). If it was synced before and
+        ``stale_while_revalidate`` is set, that happens in the background
+        and the stored rows are returned right away, as they are when the
+        daily full sync is due. Otherwise it is
+        synced here, within ``fetch_timeout``; if that runs out, the rows
+        that arrived are returned and the sync is finished by a background
+        job without a deadline. No sync is started here while that job
+        runs, nor before a failed one is due again (see _sync_due). If
+        ``query`` was never synced and ``plan`` has server filters, only
+        the requests they select are fetched here (see fetch_view) and the
+        whole view is synced in the background.
+        """
+        where = plan.merge_where(where)
+        if where is None:  # e.g. submitter=someone_else in 'my' view
+            return [], False
+        _, synced_at = self.store.sync_state(query)
+        if time.time() - synced_at >= SYNC_INTERVAL:
+            from workflow.background import is_running
+            sync_job = [
+                '/usr/bin/python',
+                self.wf.workflowfile('reviewboard.py'),
+                'sync', query]
+            if is_running('refresh-' + query):
+                # only flags the view as refreshing, so Alfred reruns
+                self.wf.refresh_in_background(query, sync_job)
+            elif not self._sync_due(query):
+                pass  # back off after failures, without rerunning
+            elif synced_at and (self.wf.settings['stale_while_revalidate'] or
+                                self._full_sync_due(query)):
+                self.wf.refresh_in_background(query, sync_job)
+            elif not synced_at and plan.server:
+                self.fetch_view(wrapper, query, plan.server)
+                self.wf.refresh_in_background(query, sync_job)
+            elif not self.sync_view(wrapper, query):
+                self.wf.refresh_in_background(query, sync_job)
+        if search_terms and self._summary_only():
+            rows = self.store.requests(terms=search_terms, **where)
+            if len(rows) >= LIMIT:
+                return rows, True
+        return self.get_cr_columns().select(**where), False
+
+    def get_cr_columns(self):
+        """Open the columnar snapshot of the store (see cr_columns.py),
+        rebuilding it when review requests were saved since it was written
+        """
+        version = self.store.version()
+        if (self._cr_columns is not None and
+                self._cr_columns.version == version):
+            return self._cr_columns
+
+        # a replaced snapshot is not closed: rows of earlier queries, e.g.
+        # in a daemon's summary index, may still read from it
+        path = self.wf.cachefile('review_requests.cols')
+        columns = None
+        if os.path.exists(path):
+            try:
+                columns = cr_columns.ReviewRequestColumns(path)
+            except ValueError:  # written by another version
+                pass
+        if columns is None or columns.version != version:
+            cr_columns.build(path, self.store.requests(), version)
+            columns = cr_columns.ReviewRequestColumns(path)
+        self._cr_columns = columns
+        return columns
+
+    def _sync_due(self, query):
+        """Whether a sync of ``query`` may start: after a sync that did
+        not complete, the next one waits SYNC_RETRY seconds, twice as long
+        for every further failure, up to SYNC_INTERVAL.
+        """
+        attempted_at, failures = self.store.sync_attempt(query)
+        if not failures:
+            return True
+        delay = min(SYNC_RETRY * 2 ** (failures - 1), SYNC_INTERVAL)
+        return time.time() - attempted_at >= delay
+
+    def _full_sync_due(self, query):
+        """Return whether the next sync of ``query`` fetches the whole
+        view, see sync_view
+        """
+        return (time.time() - self.store.full_synced_at(query) >=
+                FULL_SYNC_INTERVAL)
+
+    @staticmethod
+    def _view_sync(wrapper, query):
+        """Return the RBWrapper sync method and user of view ``query``
+        ('from:<user>' or 'to:<user>')
+        """
+        direction, username = query.split(':', 1)
+        if direction == 'from':
+            return wrapper.sync_cr_from, username
+        return wrapper.sync_cr_to, username
+
+    def sync_view(self, wrapper, query):
+        """Fetch the review requests of view ``query`` that changed since
+        its stored high-water mark.
+
+        Changes only show requests that are still in the view, so once a
+        day (FULL_SYNC_INTERVAL) the whole view is fetched instead, and
+        stored requests of the view it no longer returns are dropped: the
+        user is taken out of their target_people for a 'to:' view, they
+        are deleted for a 'from:' view.
+
+        Rows of a sync that ran out of time are saved, but the mark stays
+        put so the next sync resumes from it. Returns whether the sync
+        completed.
+
+        Pages the server answers with 304 Not Modified hold rows the
+        previous sync stored, so they are skipped (see RBWrapper.sync),
+        unless that sync did not complete or this one is a full sync.
+        """
+        sync, username = self._view_sync(wrapper, query)
+        _, failures = self.store.sync_attempt(query)
+        self.store.start_sync(query)
+        last_updated, _ = self.store.sync_state(query)
+        full = self._full_sync_due(query)
+        try:
+            rows, last_updated = sync(
+                [], None if full else last_updated, username,
+                skip_reused=not (full or failures))
+        except FetchTimeout as e:
+            self.wf.logger.warning('%s: %s', query, e)
+            self.store.save(e.partial)
+        else:
+            self.store.save(rows)
+            if full:
+                self._drop_stale(query, {row['id'] for row in rows})
+            self.store.set_sync_state(query, last_updated, full=full)
+            return True
+        return False
+
+    def _drop_stale(self, query, ids):
+        """Drop the stored requests of view ``query`` not among ``ids``,
+        those a full sync of it returned
+        """
+        direction, username = query.split(':', 1)
+        where = {'submitter' if direction == 'from' else 'target': username}
+        stale = [row['id'] for row in self.store.requests(**where)
+                 if row['id'] not in ids]
+        if not stale:
+            return
+        self.wf.logger.info('%s: dropping %s', query, stale)
+        if direction == 'from':
+            self.store.delete(stale)
+        else:
+            self.store.remove_target(username, stale)
+
+    def fetch_view(self, wrapper, query, filters):
+        """Fetch the review requests of view ``query`` selected by the
+        server-side ``filters``, e.g. ``status='pending'``, once.
+
+        No high-water mark is kept for them: a later change of the
+        filtered column would take a request out of such a fetch, so only
+        sync_view can keep the stored rows current.
+        """
+        sync, username = self._view_sync(wrapper, query)
+        try:
+            rows, _ = sync([], None, username, **filters)
+        except FetchTimeout as e:
+            self.wf.logger.warning('%s: %s', query, e)
+            rows = e.partial
+        self.store.save(rows)
 
     def parse_argument(self):
         parser = argparse.ArgumentParser(prog='ReviewBoard')
@@ -64,6 +344,11 @@ class RBFlow(object):
 
         subparsers.add_parser('update_users')
 
+        subparsers.add_parser('prefetch')
+
+        sync_parser = subparsers.add_parser('sync')
+        sync_parser.add_argument('query')
+
         search_parser = subparsers.add_parser('search', help='search help')
         search_subparsers = search_parser.add_subparsers(dest='query_type')
 
@@ -85,13 +370,39 @@ class RBFlow(object):
     def main(self, wf):
         args = self.parse_argument()
         if args.action_type == 'configure':
+            from settings_window import open_settings
             open_settings(self)
 
-        wrapper = self.get_rb_wrapper()
+        wrapper = self.get_rb_wrapper(
+            background=args.action_type in ('update_users', 'sync'))
         if args.action_type == 'update_users':
             return self.update_users(wrapper)
 
+        if args.action_type == 'prefetch':
+            return self.prefetch()
+
+        if args.action_type == 'sync':
+            synced = self.sync_view(wrapper, args.query)
+            # build the snapshot here rather than in the next search
+            self.get_cr_columns()
+            return synced
+
         if args.action_type == 'search':
+            if self.wf.settings['daemon']:
+                self._run_in_background(
+                    'daemon', [
+                        '/usr/bin/python',
+                        self.wf.workflowfile('rb_daemon.py')])
+            if self.wf.settings['prefetch']:
+                self._run_in_background(
+                    'prefetch', [
+                        '/usr/bin/python',
+                        self.wf.workflowfile('reviewboard.py'),
+                        'prefetch'])
+            if not self.wf.getvar('_WF_SESSION_ID'):
+                # first keystroke of a new session
+                self.wf.clear_session_cache()
+
             if args.query_type == 'user':
                 return self.query_user_crs(wrapper, args)
 
@@ -104,18 +415,107 @@ class RBFlow(object):
         if args.action_type == "launch":
             return self.launch(wrapper, args)
 
+    def prefetch(self):
+        """Keep the views of the user and of recently searched users
+        synced, see prefetch.py. Settings and login are read again before
+        every pass, and the job exits once ``prefetch`` is turned off.
+        """
+        from prefetch import Scheduler
+        current = {}
+
+        def _sync(view):
+            if not self.sync_view(current['wrapper'], view):
+                return False
+            # build the snapshot here rather than in the next search
+            self.get_cr_columns()
+            return True
+
+        scheduler = Scheduler(
+            _sync, self.wf.settings['prefetch_interval'],
+            logger=self.wf.logger)
+
+        def _views():
+            # changed by searches and the settings window meanwhile
+            settings = self.wf.reload_settings()
+            if not settings['prefetch']:
+                return None
+            login_info = self.get_login_info()
+            key = (login_info, settings['prefetch_workers'])
+            if current.get('key') != key:
+                current['key'] = key
+                current['wrapper'] = self.get_rb_wrapper(
+                    max_workers=settings['prefetch_workers'],
+                    background=True, login_info=login_info)
+            scheduler.interval = settings['prefetch_interval']
+
+            user = login_info['user']
+            recent = self.wf.stored_data('recent_users') or []
+            users = [user] + [name for name in recent if name != user]
+            return ['to:{}'.format(user)] + [
+                'from:{}'.format(name)
+                for name in users[:settings['prefetch_users'] + 1]]
+
+        scheduler.run(_views, lambda view: self.store.sync_state(view)[1])
+
     def update_users(self, wrapper):
-        wrapper = self.get_rb_wrapper()
-        user_dicts = wrapper.get_user_lists()
-        self.wf.cache_data('users', user_dicts)
-        self.wf.cache_data('users_list', user_dicts.keys())
+        """Refresh the cached user directory from the server
+
+        Only entries that differ from the stored directory are replaced.
+        Users the server no longer lists (deactivated accounts) are kept as
+        tombstones marked ``deleted`` so names remembered elsewhere, e.g.
+        in ``recent_users``, still resolve; they are left out of
+        ``users_list``. ``users`` is written before ``users_list``, so
+        every name in the list is always in the directory.
+
+        The number of changed entries per run is kept in the
+        ``users_refresh_stats`` data store.
+        """
+        directory = dict(self.wf.cached_data('users', max_age=0) or {})
+        fetched = wrapper.get_user_lists()
+        stats = {
+            'time': time.time(),
+            'fetched': len(fetched),
+            'added': 0,
+            'updated': 0,
+            'removed': 0,
+        }
+        for username in sorted(fetched):
+            user = fetched[username]
+            if username not in directory:
+                stats['added'] += 1
+            elif directory[username] != user:
+                stats['updated'] += 1
+            else:
+                continue
+            directory[username] = user
+        for username, user in directory.items():
+            if username not in fetched and not user.get('deleted'):
+                directory[username] = dict(user, deleted=True)
+                stats['removed'] += 1
+
+        if stats['added'] or stats['updated'] or stats['removed']:
+            # the largest cache, written in the background and rarely read
+            self.wf.cache_data('users', directory, compression='zlib')
+        # tombstones included, so recent users that left still resolve
+        user_index.build(self.wf.cachefile('users.idx'), directory.values())
+        active = [
+            user for user in directory.values() if not user.get('deleted')]
+        # always rewritten, its age tells when the directory was checked
+        self.wf.cache_data(
+            'users_list', sorted(user['username'] for user in active))
+
+        self.wf.logger.info(
+            'users refreshed: %(fetched)d fetched, %(added)d added, '
+            '%(updated)d updated, %(removed)d removed', stats)
+        history = self.wf.stored_data('users_refresh_stats') or []
+        self.wf.store_data('users_refresh_stats', (history + [stats])[-30:])
 
     def _parse_filters(self, filter_args):
         search_term = []
         extra_filter = {}
-        operators = {'~', '='}
+        operators = {'~', '=', '<', '>'}
         for filter_string in filter_args:
-            m = re.match('(?P<column>.*)(?P<operator>[~=])(?P<value>.*)', filter_string)
+            m = re.match('(?P<column>.*?)(?P<operator>[~=<>])(?P<value>.*)', filter_string)
             if m:
                 extra_filter[m.group('column')] = (
                     m.group('operator'), m.group('value'))
@@ -125,26 +525,99 @@ class RBFlow(object):
             parsed_filter = filter_string.split(':')
         return [search_term, extra_filter]
 
-    def _filter_cr(self, rows, search_terms, extra_filter):
-        if extra_filter:
-            rows = filter(
-                lambda row: all(
-                    row[key] == value if operator == '=' else value in row[key]
-                    for key, (operator, value) in extra_filter.iteritems()),
-                rows)
-        for search_term in search_terms:
-            rows = self.wf.filter(search_term.strip(), rows, itemgetter('summary'))
+    def _filter_cr(self, rows, search_terms, plan, narrowed=False):
+        """Return the best matches of ``search_terms`` among ``rows``
+
+        Rows ``narrowed`` by the full-text index differ on every
+        keystroke, so neither the candidates of the previous keystroke nor
+        the summary index would ever apply to them; both are skipped.
+        """
+        rows = plan.filter(rows)
+        if search_terms and not self._summary_only():
+            weights = self.wf.settings['match_fields']
+            return self.wf.filter_fields(
+                ' '.join(search_terms), rows,
+                lambda row: self._field_keys(row, weights),
+                max_results=LIMIT)
+        # only the order of the last pass matters and only LIMIT rows
+        # are shown, so the last pass keeps just the best LIMIT matches.
+        # Each pass narrows the candidates of the previous keystroke.
+        for i, search_term in enumerate(search_terms, 1):
+            rows = self.wf.filter(
+                search_term.strip(), rows, self._summary_key,
+                max_results=LIMIT if i == len(search_terms) else 0,
+                index=(self._summary_index_for(rows)
+                       if i == 1 and not narrowed else None),
+                session=(None if narrowed
+                         else 'review_requests-{}'.format(i)),
+                item_id=self._row_id)
         return rows
 
+    def _summary_index_for(self, rows):
+        """Return a FilterIndex over ``rows`` when it pays off, i.e. in
+        the daemon for large row sets. It is rebuilt whenever the rows or
+        their last update change.
+        """
+        if not self.resident or len(rows) < INDEX_MIN_ROWS:
+            return None
+        signature = [(row['id'], row['last_updated']) for row in rows]
+        if (self._summary_index is None or
+                self._summary_index[0] != signature):
+            self._summary_index = (
+                signature, FilterIndex(rows, self._summary_key))
+        return self._summary_index[1]
+
+    @staticmethod
+    def _row_id(row):
+        """Session filter ID of ``row``: its id and last update, so a
+        request a sync changed between keystrokes is scanned again
+        """
+        return row['id'], to_micros(row['last_updated'])
+
+    def _summary_only(self):
+        """Whether search terms are matched against summaries alone"""
+        return set(self.wf.settings['match_fields']) == {'summary'}
+
+    def _summary_key(self, row):
+        return self._filter_key(row['summary'])
+
+    def _field_keys(self, row, weights):
+        """Return the (search key, weight) pairs of ``row`` for
+        Workflow.filter_fields; target_people gives one key per person.
+        """
+        for field in MATCH_FIELDS:
+            weight = weights.get(field)
+            if not weight:
+                continue
+            values = row[field]
+            if field == 'id':
+                values = [str(values)]
+            elif field != 'target_people':
+                values = [values]
+            for value in values:
+                if value:
+                    yield self._filter_key(value), weight
+
+    def _filter_key(self, value):
+        # compiled once per value and kept for the life of the process,
+        # so a daemon only compiles values it has not seen before. Without
+        # the daemon every keystroke compiles them again: keys are not
+        # cached on disk, as the marshal cache serializer can't store them
+        # and unpickling them costs nearly as much as compiling them
+        if value not in self._filter_keys:
+            self._filter_keys[value] = self.wf.filter_key(value)
+        return self._filter_keys[value]
+
     def search_user_name(self, prefix, limit=LIMIT):
         user_search_history = self.wf.stored_data('recent_users') or []
         if prefix.strip() != '':
-            matched_recent_users = self.wf.filter(prefix, user_search_history)
+            matched_recent_users = self.wf.filter(
+                prefix, user_search_history, max_results=limit)
         else:
             matched_recent_users = user_search_history
 
         if not self.wf.cached_data_fresh('users_list', 86400):
-            run_in_background(
+            self._run_in_background(
                 'update_users', [
                     '/usr/bin/python',
                     self.wf.workflowfile('reviewboard.py'),
@@ -152,25 +625,56 @@ class RBFlow(object):
 
         # if is_running('update_users'):
         #    self.wf.add_item('Updating users', icon=ICON_INFO)
-        user_caches = self.wf.cached_data('users', max_age=0) or dict()
-        users_list = self.wf.cached_data('users_list', max_age=0) or set()
-
-        if prefix.strip() != '':
-            matched_cached_users = self.wf.filter(
-                prefix,
-                users_list)
-        else:
-            matched_cached_users = users_list
-
-        # remove duplicated
-        matched_users = matched_recent_users + [
-            user
-            for user in matched_cached_users
-            if user not in set(matched_recent_users)]
-
-        return [
-            user_caches[user] for user in matched_users[:limit]
-        ]
+        index = self.get_user_index()
+        if index is None:
+            return []
+
+        recent_rows = [
+            row for row in map(index.get, matched_recent_users) if row]
+        recent = {row['username'] for row in recent_rows}
+        wanted = limit + len(recent)
+        matched_rows = index.search(prefix, wanted)
+        if prefix.strip() and len(matched_rows) < wanted:
+            # initials and scattered characters, e.g. 'jsmith' for
+            # john.smith, by the rules the recent users are matched with
+            found = {row['username'] for row in matched_rows}
+            users_list = self.wf.cached_data('users_list', max_age=0) or []
+            matched_rows += [
+                row for row in map(index.get, self.wf.filter(
+                    prefix, users_list, max_results=wanted + len(found)))
+                if row and row['username'] not in found]
+        matched_rows = [
+            row for row in matched_rows if row['username'] not in recent]
+        return (recent_rows + matched_rows)[:limit]
+
+    def get_user_index(self):
+        """Open the user autocomplete index, reopening it after
+        update_users replaced it. Returns None if there is no directory
+        yet.
+        """
+        path = self.wf.cachefile('users.idx')
+        if not os.path.exists(path) and not self._build_user_index(path):
+            return None
+
+        if (self._user_index is None or
+                self._user_index.mtime != os.stat(path).st_mtime):
+            try:
+                self._user_index = user_index.UserIndex(path)
+            except ValueError:  # written by an earlier version
+                if not self._build_user_index(path):
+                    return None
+                self._user_index = user_index.UserIndex(path)
+        return self._user_index
+
+    def _build_user_index(self, path):
+        """Index the cached user directory, e.g. one cached before the
+        index existed. Returns False if there is no directory yet.
+        """
+        users = self.wf.cached_data('users', max_age=0)
+        if not users:
+            return False
+        user_index.build(path, users.values())
+        return True
 
     def query_user_crs(self, wrapper, args):
         user_rows = self.search_user_name(args.search_user)
@@ -180,22 +684,26 @@ class RBFlow(object):
             if extra_filter == ['-']:
                 extra_filter = []
             selected = user_rows[0]
-            cr_rows = self.wf.cached_data(
-                '{}_requests'.format(selected['username']),
-                lambda: wrapper.search_cr_from(selected['username']),
-                max_age=60 * 15)
+            username = selected['username']
+            search_terms, column_filter = self._parse_filters(extra_filter)
+            plan = QueryPlan(column_filter)
+            self.report_unknown_columns(plan)
+            cr_rows, narrowed = self._synced_crs(
+                wrapper, 'from:{}'.format(username),
+                search_terms, plan,
+                submitter=username)
+            cr_rows = self._filter_cr(
+                cr_rows, search_terms, plan, narrowed)
         else:
             cr_rows = []
 
-        cr_rows = self._filter_cr(
-            cr_rows,
-            *self._parse_filters(extra_filter))
-
         if not cr_rows:  # Show users
             self.build_user_items(user_rows)
 
         else:   # List CRs
             self.build_items(cr_rows[:LIMIT])
+            # prefetched along with the user's own views, see prefetch
+            self.log_searched_user(username)
 
         user_url = wrapper.get_user_cr_url(args.search_user)
         self.wf.add_item(
@@ -207,13 +715,15 @@ class RBFlow(object):
         self.wf.send_feedback()
 
     def query_my_crs(self, wrapper, args):
-        cr_rows = self.wf.cached_data(
-            '{}_requests'.format(wrapper.user),
-            lambda: wrapper.search_cr_from(),
-            max_age=60 * 15)
+        search_terms, extra_filter = self._parse_filters(args.extra_filter)
+        plan = QueryPlan(extra_filter)
+        self.report_unknown_columns(plan)
+        cr_rows, narrowed = self._synced_crs(
+            wrapper, 'from:{}'.format(wrapper.user),
+            search_terms, plan,
+            submitter=wrapper.user)
         cr_rows = self._filter_cr(
-            cr_rows,
-            *self._parse_filters(args.extra_filter))
+                cr_rows, search_terms, plan, narrowed)
 
         self.build_items(cr_rows[:LIMIT])
         user_url = wrapper.get_user_cr_url()
@@ -228,13 +738,15 @@ class RBFlow(object):
 
     def query_to_me_crs(self, wrapper, args):
         wrapper = self.get_rb_wrapper()
-        cr_rows = self.wf.cached_data(
-            'requests_to_me',
-            lambda: wrapper.search_cr_to(),
-            max_age=60 * 15)
+        search_terms, extra_filter = self._parse_filters(args.extra_filter)
+        plan = QueryPlan(extra_filter)
+        self.report_unknown_columns(plan)
+        cr_rows, narrowed = self._synced_crs(
+            wrapper, 'to:{}'.format(wrapper.user),
+            search_terms, plan,
+            target=wrapper.user)
         cr_rows = self._filter_cr(
-            cr_rows,
-            *self._parse_filters(args.extra_filter))
+                cr_rows, search_terms, plan, narrowed)
 
         self.build_items(cr_rows[:LIMIT])
         dashboard_url = wrapper.get_dashboard_url()
@@ -247,8 +759,30 @@ class RBFlow(object):
         )
         self.wf.send_feedback()
 
+    def report_unknown_columns(self, plan):
+        for column in plan.unknown:
+            self.wf.add_item(
+                title='Unknown filter column: {}'.format(column),
+                subtitle='filter on one of: {}'.format(', '.join(COLUMNS)),
+                valid=False,
+                icon=ICON_WARNING)
+        for column, operator, value in plan.invalid:
+            if column in INT_COLUMNS:
+                subtitle = '{} takes a number'.format(column)
+            elif column in TIME_COLUMNS:
+                subtitle = '{} takes a date, e.g. 2020-05-01'.format(column)
+            else:
+                subtitle = '{} takes = or ~'.format(column)
+            self.wf.add_item(
+                title='Invalid filter: {}{}{}'.format(column, operator, value),
+                subtitle=subtitle,
+                valid=False,
+                icon=ICON_WARNING)
+
     def log_searched_user(self, username):
         user_search_history = self.wf.stored_data('recent_users') or []
+        if user_search_history[:1] == [username]:
+            return
         user_search_history = [username] + [
             user for user in user_search_history if user != username]
         self.wf.store_data('recent_users', user_search_history[:10])
@@ -258,6 +792,7 @@ class RBFlow(object):
         return self.wf.send_feedback()
 
     def store_config(self, config):
+        from workflow import notify
         try:
             self.wf.save_password('review_board', config["password"])
             login_info = self.get_login_info()
@@ -336,13 +871,20 @@ class RBFlow(object):
                 valid=True,
                 icon=_select_icon(row))
 
+        if self.wf.refreshing:
+            self.wf.add_item(
+                title='Refreshing review requests...',
+                subtitle='results update when the sync is done',
+                valid=False,
+                icon=ICON_SYNC)
+
 
     def launch(self, wrapper, args):
         launch_args = args.launch_args
 
         if re.match('^user-', launch_args):
             username = launch_args.replace('user-', '')
-            # TODO: log_user
+            self.log_searched_user(username)
             return
 
         url = None
@@ -355,9 +897,14 @@ class RBFlow(object):
             url = wrapper.get_cr_url(cr_id)
 
         if url:
+            import subprocess
             subprocess.call(['open', url])
 
 
-if __name__ == u"__main__":
+def main():
     flow = RBFlow()
-    sys.exit(flow.wf.run(flow.main))
+    return flow.wf.run(flow.main)
+
+
+if __name__ == u"__main__":
+    sys.exit(main())
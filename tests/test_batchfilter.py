@@ -0,0 +1,89 @@
+# encoding: utf-8
+"""The NumPy filter engine scores exactly like Workflow._filter_matches
+
+    python -m unittest discover tests
+"""
+from __future__ import unicode_literals
+
+import os
+import random
+import sys
+import unittest
+
+if sys.version_info[0] != 2:
+    raise unittest.SkipTest('the workflow runs on Python 2')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from workflow import MATCH_ALL  # noqa: E402
+from workflow import MATCH_ALLCHARS  # noqa: E402
+from workflow import MATCH_CAPITALS  # noqa: E402
+from workflow import MATCH_STARTSWITH  # noqa: E402
+from workflow import MATCH_SUBSTRING  # noqa: E402
+from workflow import Workflow  # noqa: E402
+
+try:
+    from workflow import batchfilter
+except ImportError:  # NumPy is not installed
+    batchfilter = None
+
+WORDS = (
+    'Fix Add Remove Refactor Update Bump Revert Use Cache Handle Speed up '
+    'search filter index daemon review request user directory page '
+    'fetcher timeout SQLite store session API root settings Alfred '
+    'Workflow RBTools pagination unicode café naïve déjà vu').split()
+QUERIES = ['fix', 'rs', 'cache page', 'srch', 'cafe', 'café', 'ru d',
+           'xyz', 'SQL', 'f']
+RULES = [
+    MATCH_ALL,
+    MATCH_ALL ^ MATCH_ALLCHARS,
+    MATCH_STARTSWITH | MATCH_SUBSTRING,
+    MATCH_CAPITALS,
+]
+
+
+@unittest.skipIf(batchfilter is None, 'NumPy is not installed')
+class BatchFilterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.wf = Workflow()
+        rnd = random.Random(0)
+        summaries = [
+            '{0} #{1}'.format(
+                ' '.join(rnd.sample(WORDS, rnd.randint(1, 9))), i)
+            for i in range(500)]
+        summaries += ['', '   ', 'x', 'Ünïcödé ßummary']
+        self.pairs = [(summary, self.wf.filter_key(summary))
+                      for summary in summaries]
+
+    def assertSameMatches(self, words, pairs, match_on):
+        expected = list(self.wf._filter_matches(words, pairs, match_on))
+        actual = list(batchfilter.filter_matches(
+            self.wf, words, pairs, match_on))
+        self.assertEqual(actual, expected)
+
+    def test_same_matches(self):
+        for query in QUERIES:
+            words = self.wf._filter_words(query, True)
+            for match_on in RULES:
+                self.assertSameMatches(words, self.pairs, match_on)
+
+    def test_without_diacritic_folding(self):
+        for query in ['cafe', 'café', 'naive']:
+            words = self.wf._filter_words(query, False)
+            self.assertSameMatches(words, self.pairs, MATCH_ALL)
+
+    def test_reused_columns(self):
+        # a subset of the keys filtered last reuses their arrays
+        words = self.wf._filter_words('fix', True)
+        self.assertSameMatches(words, self.pairs, MATCH_ALL)
+        self.assertSameMatches(words, self.pairs[::3], MATCH_ALL)
+
+    def test_plain_string_keys(self):
+        pairs = [(item, item) for item, _ in self.pairs]
+        words = self.wf._filter_words('rs', True)
+        self.assertSameMatches(words, pairs, MATCH_ALL)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+# encoding: utf-8
+"""Columnar snapshots written by cr_columns.build
+
+    python -m unittest discover tests
+"""
+from __future__ import unicode_literals
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+
+if sys.version_info[0] != 2:
+    raise unittest.SkipTest('the workflow runs on Python 2')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cr_columns  # noqa: E402
+from cr_store import COLUMNS  # noqa: E402
+from cr_store import ReviewRequest  # noqa: E402
+
+
+def request(id, last_updated, **values):
+    fields = {
+        'summary': 'Fix cache bug',
+        'status': 'pending',
+        'submitter': 'alice',
+        'repo': 'rbtools',
+        'time_added': datetime(2020, 5, 1, 9, 30),
+        'last_updated': last_updated,
+        'ship_it_count': 0,
+        'issue_open_count': 0,
+        'absolute_url': 'http://rb/r/{}/'.format(id),
+        'target_people': ['bob', 'carol'],
+        'primary_reviewers': [],
+    }
+    fields.update(values)
+    return ReviewRequest(id=id, **fields)
+
+
+# newest first, as ReviewRequestStore.requests returns them
+ROWS = [
+    request(3, datetime(2021, 1, 3, 0, 0, 0, 250), status='submitted',
+            summary='Caf\xe9 menu ☕', ship_it_count=2,
+            target_people=['dave'], primary_reviewers=['dave']),
+    request(2, datetime(2020, 5, 2, 10, 0), repo=None, submitter='bob',
+            target_people=[]),
+    request(1, datetime(2020, 4, 30, 23, 59, 59), issue_open_count=1),
+]
+
+
+class ColumnsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'review_requests.cols')
+        cr_columns.build(self.path, ROWS, 42)
+        self.columns = cr_columns.ReviewRequestColumns(self.path)
+
+    def tearDown(self):
+        self.columns.close()
+        shutil.rmtree(self.tmp)
+
+    def select_ids(self, **where):
+        return [row['id'] for row in self.columns.select(**where)]
+
+    def test_round_trip(self):
+        self.assertEqual(self.columns.version, 42)
+        self.assertEqual(self.columns.count, len(ROWS))
+        for row, expected in zip(self.columns.select(), ROWS):
+            self.assertEqual({column: row[column] for column in COLUMNS},
+                             dict(expected))
+        self.assertIsNone(self.columns.select()[1]['repo'])
+
+    def test_empty(self):
+        cr_columns.build(self.path, [], 7)
+        columns = cr_columns.ReviewRequestColumns(self.path)
+        self.assertEqual((columns.version, columns.select()), (7, []))
+        columns.close()
+
+    def test_select(self):
+        self.assertEqual(self.select_ids(submitter='alice'), [3, 1])
+        self.assertEqual(self.select_ids(target='carol'), [1])
+        self.assertEqual(self.select_ids(status='pending', repo='rbtools'),
+                         [1])
+        self.assertEqual(self.select_ids(submitter='nobody'), [])
+
+    def test_select_updated_range(self):
+        self.assertEqual(
+            self.select_ids(updated_since=datetime(2020, 5, 1)), [3, 2])
+        self.assertEqual(
+            self.select_ids(updated_before=datetime(2020, 5, 2, 10, 0)), [1])
+        self.assertEqual(
+            self.select_ids(updated_since=datetime(2020, 5, 2, 10, 0),
+                            updated_before=datetime(2021, 1, 3)), [2])
+        self.assertEqual(
+            self.select_ids(submitter='alice',
+                            updated_since=datetime(2021, 1, 3)), [3])
+
+    def test_not_a_snapshot(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'RBCOLS00' + b'\0' * 12)
+        self.assertRaises(
+            ValueError, cr_columns.ReviewRequestColumns, self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+"""Import-time budget of the script filter
+
+Alfred starts ``reviewboard.py`` on every keystroke, so importing it must
+stay cheap and must not load the modules only some subcommands need, nor
+may a search the local store answers load them.
+
+The workflow runs on Python 2. The import is measured in a fresh Python 2
+process: ``$RB_PYTHON`` if set, else the running interpreter if it is a
+Python 2, else a working ``python2`` from the PATH.
+
+    python -m unittest discover tests
+"""
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+try:
+    from shutil import which
+except ImportError:  # Python 2
+    from distutils.spawn import find_executable as which
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# seconds importing reviewboard may take, best of RUNS
+IMPORT_BUDGET = 0.2
+RUNS = 3
+# modules only configure (Tkinter), refreshes (rbtools) and launch or
+# background jobs (subprocess) need
+DEFERRED_MODULES = ['Tkinter', 'rbtools', 'subprocess']
+
+MEASURE = """
+import json, sys, time
+start = time.time()
+import reviewboard
+elapsed = time.time() - start
+print(json.dumps({
+    'elapsed': elapsed,
+    'loaded': [m for m in %r if m in sys.modules],
+}))
+""" % (DEFERRED_MODULES,)
+
+# a keystroke of a session searching a view synced just now
+SEARCH = """
+import json, os, shutil, sys, tempfile
+from cStringIO import StringIO
+tmp = tempfile.mkdtemp()
+os.environ['alfred_workflow_data'] = os.path.join(tmp, 'data')
+os.environ['alfred_workflow_cache'] = os.path.join(tmp, 'cache')
+os.environ['alfred_workflow_bundleid'] = 'test.reviewboard'
+os.environ['_WF_SESSION_ID'] = 'test'
+try:
+    import reviewboard
+    flow = reviewboard.RBFlow()
+    flow.wf.store_data('login_info', {'user': 'me', 'url': 'http://rb'})
+    flow.wf.cache_data('__workflow_update_status', {'available': False})
+    flow.store.set_sync_state('from:me', None)
+    sys.argv = ['reviewboard.py', 'search', 'my', 'fix']
+    stdout, sys.stdout = sys.stdout, StringIO()
+    try:
+        flow.wf.run(flow.main)
+    finally:
+        feedback, sys.stdout = sys.stdout.getvalue(), stdout
+finally:
+    shutil.rmtree(tmp)
+print(json.dumps({
+    'feedback': json.loads(feedback),
+    'loaded': [m for m in %r if m in sys.modules],
+}))
+""" % (DEFERRED_MODULES,)
+
+
+def python2():
+    if os.environ.get('RB_PYTHON'):
+        return os.environ['RB_PYTHON']
+    if sys.version_info[0] == 2:
+        return sys.executable
+    path = which('python2')
+    # e.g. a version manager shim without a Python 2 behind it
+    if path is None or subprocess.call(
+            [path, '-c', 'import sys; sys.exit(sys.version_info[0] != 2)'],
+            stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT):
+        return None
+    return path
+
+
+@unittest.skipIf(python2() is None, 'no Python 2 interpreter found')
+class ImportTimeTest(unittest.TestCase):
+
+    def measure(self, script=MEASURE):
+        output = subprocess.check_output(
+            [python2(), '-c', script], cwd=ROOT)
+        return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+    def test_import_budget(self):
+        elapsed = min(self.measure()['elapsed'] for _ in range(RUNS))
+        self.assertLess(elapsed, IMPORT_BUDGET)
+
+    def test_deferred_modules_not_loaded(self):
+        self.assertEqual(self.measure()['loaded'], [])
+
+    def test_store_served_search_loads_no_deferred_modules(self):
+        result = self.measure(SEARCH)
+        # answered without an error item
+        self.assertEqual(
+            [item['title'] for item in result['feedback']['items']],
+            ['Go to my page directly'])
+        self.assertEqual(result['loaded'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+# encoding: utf-8
+"""Column filters planned by query_plan.QueryPlan
+
+    python -m unittest discover tests
+"""
+from __future__ import unicode_literals
+
+import os
+import sys
+import unittest
+from datetime import datetime
+
+if sys.version_info[0] != 2:
+    raise unittest.SkipTest('the workflow runs on Python 2')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cr_store import ReviewRequest  # noqa: E402
+from query_plan import QueryPlan  # noqa: E402
+
+
+def request(id, **values):
+    fields = {
+        'summary': 'Fix cache bug',
+        'status': 'pending',
+        'submitter': 'alice',
+        'repo': 'rbtools',
+        'time_added': datetime(2020, 5, 1, 9, 30),
+        'last_updated': datetime(2020, 5, 2, 10, 0),
+        'ship_it_count': 0,
+        'issue_open_count': 0,
+        'absolute_url': 'http://rb/r/{}/'.format(id),
+        'target_people': ['bob', 'carol'],
+        'primary_reviewers': [],
+    }
+    fields.update(values)
+    return ReviewRequest(id=id, **fields)
+
+
+ROWS = [
+    request(123),
+    request(1234, ship_it_count=1, repo=None,
+            last_updated=datetime(2021, 1, 3, 0, 0)),
+    request(7, summary='Add prefix index', issue_open_count=2,
+            target_people=['dave']),
+]
+
+
+def plan_ids(**filters):
+    plan = QueryPlan(filters)
+    return [row['id'] for row in plan.filter(ROWS)]
+
+
+class QueryPlanTest(unittest.TestCase):
+
+    def test_number_columns(self):
+        self.assertEqual(plan_ids(id=('=', '123')), [123])
+        self.assertEqual(plan_ids(id=('~', '12')), [123, 1234])
+        self.assertEqual(plan_ids(ship_it_count=('=', '1')), [1234])
+        self.assertEqual(plan_ids(issue_open_count=('=', '0')), [123, 1234])
+
+    def test_invalid_number(self):
+        plan = QueryPlan({'id': ('=', 'abc')})
+        self.assertEqual(plan.invalid, [('id', '=', 'abc')])
+        self.assertEqual(plan.unknown, [])
+        self.assertEqual(len(plan.filter(ROWS)), 3)
+
+    def test_date_columns(self):
+        self.assertEqual(plan_ids(last_updated=('~', '2020')), [123, 7])
+        self.assertEqual(plan_ids(last_updated=('=', '2021-01')), [1234])
+        self.assertEqual(plan_ids(time_added=('~', '09:30')),
+                         [123, 1234, 7])
+        self.assertEqual(plan_ids(last_updated=('=', '2020-05-03')), [])
+
+    def test_order_on_number_and_date_columns(self):
+        self.assertEqual(plan_ids(id=('>', '123')), [1234])
+        self.assertEqual(plan_ids(ship_it_count=('<', '1')), [123, 7])
+        self.assertEqual(plan_ids(time_added=('>', '2020-05-01T09:30')),
+                         [123, 1234, 7])
+        self.assertEqual(plan_ids(time_added=('<', '2020-05')), [])
+
+    def test_last_updated_range_goes_to_store_and_server(self):
+        plan = QueryPlan({'last_updated': ('>', '2020-05')})
+        self.assertEqual(plan.where,
+                         {'updated_since': datetime(2020, 5, 1)})
+        self.assertEqual(plan.server,
+                         {'last_updated_from': '2020-05-01T00:00:00Z'})
+        self.assertEqual(plan.predicates, [])
+        plan = QueryPlan({'last_updated': ('<', '2021-01-03')})
+        self.assertEqual(plan.where,
+                         {'updated_before': datetime(2021, 1, 3)})
+        self.assertEqual(plan.server,
+                         {'last_updated_to': '2021-01-03T00:00:00Z'})
+
+    def test_invalid_order(self):
+        plan = QueryPlan({'last_updated': ('>', 'May'),
+                          'summary': ('<', 'b'),
+                          'id': ('<', 'x')})
+        self.assertEqual(plan.invalid, [('id', '<', 'x'),
+                                        ('last_updated', '>', 'May'),
+                                        ('summary', '<', 'b')])
+        self.assertEqual((plan.where, plan.predicates), ({}, []))
+
+    def test_list_columns(self):
+        self.assertEqual(plan_ids(target_people=('=', 'dave')), [7])
+        self.assertEqual(plan_ids(target_people=('=', 'dav')), [])
+        self.assertEqual(plan_ids(target_people=('~', 'car')), [123, 1234])
+        self.assertEqual(plan_ids(primary_reviewers=('~', 'a')), [])
+
+    def test_string_columns(self):
+        self.assertEqual(plan_ids(summary=('~', 'prefix')), [7])
+        self.assertEqual(plan_ids(repo=('~', 'rb')), [123, 7])
+        self.assertEqual(plan_ids(absolute_url=('=', 'http://rb/r/7/')),
+                         [7])
+
+    def test_all_predicates_apply(self):
+        self.assertEqual(
+            plan_ids(id=('~', '12'), ship_it_count=('=', '0')), [123])
+
+    def test_rows_as_dicts(self):
+        plan = QueryPlan({'id': ('=', '7'), 'target_people': ('~', 'av')})
+        self.assertEqual(len(plan.filter([dict(row) for row in ROWS])), 1)
+
+    def test_indexed_equality_goes_to_store_and_server(self):
+        plan = QueryPlan({
+            'status': ('=', 'pending'),
+            'submitter': ('=', 'alice'),
+            'repo': ('=', 'rbtools'),
+            'summary': ('~', 'fix'),
+        })
+        self.assertEqual(plan.where, {
+            'status': 'pending', 'submitter': 'alice', 'repo': 'rbtools'})
+        self.assertEqual(plan.server, {
+            'status': 'pending', 'from_user': 'alice'})
+        self.assertEqual(plan.predicates, [('summary', '~', 'fix')])
+
+    def test_unknown_columns(self):
+        plan = QueryPlan({'reviewer': ('=', 'bob')})
+        self.assertEqual(plan.unknown, ['reviewer'])
+        self.assertEqual(plan.filter(ROWS), ROWS)
+
+    def test_selectivity_order(self):
+        plan = QueryPlan({
+            'summary': ('~', 'a'),
+            'repo': ('~', 'rbtools'),
+            'id': ('=', '7'),
+        })
+        self.assertEqual([column for column, _, _ in plan.predicates],
+                         ['id', 'repo', 'summary'])
+
+    def test_merge_where(self):
+        plan = QueryPlan({'submitter': ('=', 'alice')})
+        self.assertEqual(plan.merge_where({'target': 'bob'}),
+                         {'target': 'bob', 'submitter': 'alice'})
+        self.assertIsNone(plan.merge_where({'submitter': 'bob'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+# encoding: utf-8
+"""List pages fetched by RBWrapper
+
+    python -m unittest discover tests
+"""
+from __future__ import unicode_literals
+
+import os
+import sys
+import unittest
+
+if sys.version_info[0] != 2:
+    raise unittest.SkipTest('the workflow runs on Python 2')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rb_wrapper import PAGE_SIZE  # noqa: E402
+from rb_wrapper import RBWrapper  # noqa: E402
+
+
+class FakePage(list):
+
+    def __init__(self, items, total_results):
+        super(FakePage, self).__init__(items)
+        self.total_results = total_results
+
+
+class FakeRoot(object):
+    """Serves ``items`` in pages; pages starting at ``reused`` come from
+    the HTTP cache, as recorded by RBWrapper._track_reuse
+    """
+
+    def __init__(self, wrapper, items, reused):
+        self.wrapper = wrapper
+        self.items = items
+        self.reused = reused
+        self.starts = []
+
+    def get_review_requests(self, start, max_results, **filters):
+        self.starts.append(start)
+        self.wrapper._local.reused = start in self.reused
+        return FakePage(self.items[start:start + max_results],
+                        len(self.items))
+
+
+class FetchListTest(unittest.TestCase):
+
+    def fetch(self, reused, skip_reused):
+        wrapper = RBWrapper('me', 'secret', 'http://rb/', max_workers=1)
+        root = FakeRoot(wrapper, list(range(2 * PAGE_SIZE + 50)), reused)
+        wrapper._local.root = root
+        built = wrapper._fetch_list(
+            'review_requests', lambda item: item, skip_reused=skip_reused)
+        self.assertEqual(root.starts, [0, PAGE_SIZE, 2 * PAGE_SIZE])
+        return built
+
+    def test_all_pages_built(self):
+        self.assertEqual(self.fetch({0, PAGE_SIZE}, False),
+                         list(range(2 * PAGE_SIZE + 50)))
+
+    def test_reused_pages_skipped(self):
+        self.assertEqual(self.fetch({0, 2 * PAGE_SIZE}, True),
+                         list(range(PAGE_SIZE, 2 * PAGE_SIZE)))
+        self.assertEqual(self.fetch({0, PAGE_SIZE, 2 * PAGE_SIZE}, True),
+                         [])
+
+
+if __name__ == '__main__':
+    unittest.main()
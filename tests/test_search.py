@@ -0,0 +1,96 @@
+# encoding: utf-8
+"""Searches answered from the local review request store
+
+    python -m unittest discover tests
+"""
+from __future__ import unicode_literals
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+from datetime import timedelta
+
+if sys.version_info[0] != 2:
+    raise unittest.SkipTest('the workflow runs on Python 2')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cr_store import ReviewRequest  # noqa: E402
+from query_plan import QueryPlan  # noqa: E402
+from reviewboard import LIMIT  # noqa: E402
+from reviewboard import RBFlow  # noqa: E402
+
+
+def request(id, summary):
+    return ReviewRequest(
+        id=id, summary=summary, status='pending', submitter='me',
+        repo='rbtools', time_added=datetime(2020, 1, 1),
+        last_updated=datetime(2020, 1, 1) + timedelta(hours=id),
+        ship_it_count=0, issue_open_count=0,
+        absolute_url='http://rb/r/{}/'.format(id), target_people=['bob'],
+        primary_reviewers=[])
+
+
+class StoreSearchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.environ = dict(os.environ)
+        os.environ['alfred_workflow_data'] = os.path.join(self.tmp, 'data')
+        os.environ['alfred_workflow_cache'] = os.path.join(self.tmp, 'cache')
+        os.environ['alfred_workflow_bundleid'] = 'test.reviewboard'
+        self.flow = RBFlow()
+
+    def tearDown(self):
+        self.flow.store.close()
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.tmp)
+
+    def search(self, summaries, terms, filters=None):
+        """Return the summaries found for ``terms`` and column
+        ``filters`` and whether the full-text index narrowed the rows
+        """
+        self.flow.store.save(
+            [request(i, summary) for i, summary in enumerate(summaries)])
+        # synced just now, so nothing is fetched
+        self.flow.store.set_sync_state('from:me', None)
+        plan = QueryPlan(filters or {})
+        rows, narrowed = self.flow._synced_crs(
+            None, 'from:me', terms, plan, submitter='me')
+        rows = self.flow._filter_cr(rows, terms, plan, narrowed)
+        return [row['summary'] for row in rows], narrowed
+
+    def test_few_prefix_hits_keep_substring_matches(self):
+        found, narrowed = self.search(
+            ['Fix cache bug', 'Add prefix index'], ['fix'])
+        self.assertFalse(narrowed)
+        self.assertEqual(found, ['Fix cache bug', 'Add prefix index'])
+
+    def test_initials(self):
+        found, _ = self.search(
+            ['Fix cache bug', 'Add prefix index', 'Remove dead code'],
+            ['fcb'])
+        self.assertEqual(found, ['Fix cache bug'])
+
+    def test_enough_prefix_hits_narrow(self):
+        summaries = ['Fix bug {}'.format(i) for i in range(LIMIT)]
+        found, narrowed = self.search(summaries + ['Add prefix'], ['fix'])
+        self.assertEqual(narrowed, bool(self.flow.store.fts))
+        self.assertEqual(len(found), LIMIT)
+        self.assertNotIn('Add prefix', found)
+
+    def test_last_updated_range(self):
+        summaries = ['Fix bug {}'.format(i) for i in range(2 * LIMIT)]
+        since = {'last_updated': ('>', '2020-01-01T{:02}:00'.format(LIMIT))}
+        # hour i is request i, so requests LIMIT and newer match
+        for terms in [[], ['fix']]:
+            found, _ = self.search(summaries, terms, since)
+            self.assertEqual(sorted(found), sorted(summaries[LIMIT:]))
+
+
+if __name__ == '__main__':
+    unittest.main()
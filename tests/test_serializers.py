@@ -0,0 +1,160 @@
+# encoding: utf-8
+"""Data and cache files written by the workflow serializers
+
+    python -m unittest discover tests
+"""
+from __future__ import unicode_literals
+
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+from io import BytesIO
+
+if sys.version_info[0] != 2:
+    raise unittest.SkipTest('the workflow runs on Python 2')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from workflow import Workflow  # noqa: E402
+from workflow.workflow import MarshalSerializer  # noqa: E402
+
+ROWS = [
+    {'id': 1, 'summary': 'Fix cache bug', 'repo': None,
+     'last_updated': datetime(2020, 5, 2, 10, 0, 0, 250),
+     'target_people': ['bob', 'carol']},
+    {'id': 2, 'summary': 'Caf\xe9 ☕', 'repo': 'rbtools',
+     'last_updated': datetime(1969, 12, 31, 23, 59, 59),
+     'target_people': []},
+]
+
+
+def round_trip(obj):
+    buf = BytesIO()
+    MarshalSerializer.dump(obj, buf)
+    buf.seek(0)
+    return MarshalSerializer.load(buf), buf.getvalue()
+
+
+def load_stored(data_dir, name, results):
+    os.environ['alfred_workflow_data'] = data_dir
+    wf = Workflow()
+    wf.data_serializer = 'marshal'
+    try:
+        results.put(wf.stored_data(name))
+    except Exception as err:
+        results.put(repr(err))
+
+
+class MarshalSerializerTest(unittest.TestCase):
+
+    def assertRoundTrip(self, obj, encoded):
+        loaded, data = round_trip(obj)
+        self.assertEqual(loaded, obj)
+        self.assertEqual(type(loaded), type(obj))
+        self.assertEqual(data[4:5], b'E' if encoded else b'-')
+        return loaded
+
+    def test_plain(self):
+        self.assertRoundTrip(
+            {'a': [1, 2.5, None], 'b': (True, 'x'), 'c': {3}}, False)
+
+    def test_datetime(self):
+        self.assertRoundTrip(datetime(2020, 5, 2, 10, 0, 0, 250), True)
+        self.assertRoundTrip([1, datetime(1969, 1, 1), 'x'], True)
+        self.assertRoundTrip((datetime(2020, 1, 1),), True)
+        self.assertRoundTrip({datetime(2020, 1, 1)}, True)
+
+    def test_dict(self):
+        loaded = self.assertRoundTrip(
+            {'updated': datetime(2020, 1, 1), 'ids': [1, 2]}, True)
+        self.assertEqual(type(loaded['ids']), list)
+        self.assertRoundTrip({'outer': {'inner': datetime(2020, 1, 1)}},
+                             True)
+
+    def test_table(self):
+        self.assertRoundTrip(ROWS, True)
+        self.assertRoundTrip({'users': ROWS, 'count': 2}, True)
+        # columns of only None stay None
+        self.assertRoundTrip([{'a': None}, {'a': None}], False)
+        self.assertRoundTrip(
+            [{'a': None, 'b': datetime(2020, 1, 1)}, {'a': 1, 'b': None}],
+            True)
+
+    def test_not_a_table(self):
+        # different keys, or a single row
+        self.assertRoundTrip(
+            [{'a': datetime(2020, 1, 1)}, {'b': datetime(2020, 1, 1)}],
+            True)
+        self.assertRoundTrip([{'a': datetime(2020, 1, 1)}], True)
+        self.assertRoundTrip([{}, {}], False)
+
+    def test_not_marshal_data(self):
+        self.assertRaises(ValueError, MarshalSerializer.load,
+                          BytesIO(b'\x80\x02}q\x00.'))
+
+
+class MigrationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.environ = dict(os.environ)
+        self.data_dir = os.path.join(self.tmp, 'data')
+        os.environ['alfred_workflow_data'] = self.data_dir
+        os.environ['alfred_workflow_cache'] = os.path.join(self.tmp, 'cache')
+        os.environ['alfred_workflow_bundleid'] = 'test.reviewboard'
+        self.wf = Workflow()
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.tmp)
+
+    def test_stored_data(self):
+        self.wf.store_data('rows', ROWS)
+        self.wf.data_serializer = 'marshal'
+        self.assertEqual(self.wf.stored_data('rows'), ROWS)
+        self.assertEqual(sorted(os.listdir(self.data_dir)),
+                         ['.rows.alfred-workflow', 'rows.marshal'])
+        self.assertEqual(self.wf.stored_data('rows'), ROWS)
+
+    def test_missing_data_file(self):
+        self.wf.store_data('rows', ROWS)
+        os.unlink(self.wf.datafile('rows.cpickle'))
+        self.assertIsNone(self.wf.stored_data('rows'))
+        self.assertEqual(os.listdir(self.data_dir), [])
+
+    def test_cached_data(self):
+        self.wf.cache_data('rows', ROWS)
+        old_path = self.wf.cachefile('rows.cpickle')
+        os.utime(old_path, (1000000000, 1000000000))
+        self.wf.cache_serializer = 'marshal'
+        self.assertEqual(self.wf.cached_data('rows', max_age=0), ROWS)
+        self.assertFalse(os.path.exists(old_path))
+        self.assertEqual(
+            os.stat(self.wf.cachefile('rows.marshal')).st_mtime, 1000000000)
+
+    def test_overlapping_stored_data(self):
+        for round in range(5):
+            name = 'rows{}'.format(round)
+            self.wf.store_data(name, ROWS)
+            results = multiprocessing.Queue()
+            processes = [
+                multiprocessing.Process(
+                    target=load_stored, args=(self.data_dir, name, results))
+                for _ in range(6)]
+            for process in processes:
+                process.start()
+            loaded = [results.get(timeout=10) for _ in processes]
+            for process in processes:
+                process.join()
+            self.assertEqual(loaded, [ROWS] * len(processes))
+            self.assertFalse(
+                os.path.exists(self.wf.datafile(name + '.cpickle')))
+
+
+if __name__ == '__main__':
+    unittest.main()
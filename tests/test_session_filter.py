@@ -0,0 +1,96 @@
+# encoding: utf-8
+"""Workflow3.filter narrowed across keystrokes finds what a full scan does
+
+    python -m unittest discover tests
+"""
+from __future__ import unicode_literals
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+from datetime import timedelta
+
+if sys.version_info[0] != 2:
+    raise unittest.SkipTest('the workflow runs on Python 2')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reviewboard import RBFlow  # noqa: E402
+from workflow import MATCH_ALL  # noqa: E402
+from workflow import MATCH_ALLCHARS  # noqa: E402
+from workflow import Workflow  # noqa: E402
+from workflow import Workflow3  # noqa: E402
+
+SUMMARIES = [
+    'Fix cache bug', 'Add prefix index', 'Refactor page fetcher',
+    'Fix crash in settings', 'Speed up user search', 'Cache API root',
+    'Remove dead code', 'Handle unicode in summaries', 'Bump version',
+]
+KEYSTROKES = ['f', 'fi', 'fix', 'fix ', 'fix c', 'fix ca', 'fix cac',
+              'fix ca', 'fix c', 'fix cr']
+
+
+class SessionFilterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.environ = dict(os.environ)
+        os.environ['alfred_workflow_data'] = os.path.join(self.tmp, 'data')
+        os.environ['alfred_workflow_cache'] = os.path.join(self.tmp, 'cache')
+        os.environ['alfred_workflow_bundleid'] = 'test.reviewboard'
+        os.environ['_WF_SESSION_ID'] = 'test'
+        self.wf = Workflow3()
+        start = datetime(2020, 1, 1)
+        self.rows = [
+            {'id': i, 'summary': summary,
+             'last_updated': start + timedelta(hours=i)}
+            for i, summary in enumerate(SUMMARIES)]
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.tmp)
+
+    def assertSameAsFullScan(self, query, match_on=MATCH_ALL):
+        key = lambda row: row['summary']  # noqa: E731
+        narrowed = self.wf.filter(
+            query, self.rows, key, include_score=True, match_on=match_on,
+            session='summaries-{}'.format(match_on), item_id=RBFlow._row_id)
+        full = Workflow.filter(
+            self.wf, query, self.rows, key, include_score=True,
+            match_on=match_on)
+        self.assertEqual(narrowed, full, query)
+
+    def test_keystrokes(self):
+        for match_on in [MATCH_ALL, MATCH_ALL ^ MATCH_ALLCHARS]:
+            for query in KEYSTROKES:
+                self.assertSameAsFullScan(query, match_on)
+
+    def test_row_edited_between_keystrokes(self):
+        self.assertSameAsFullScan('fix')
+        self.assertSameAsFullScan('fix c')
+        # a sync changes a summary, the set of ids stays the same
+        self.rows[6] = dict(
+            self.rows[6], summary='Fix cache eviction',
+            last_updated=self.rows[6]['last_updated'] + timedelta(days=1))
+        self.assertSameAsFullScan('fix ca')
+        self.assertIn(
+            6, [row['id'] for row in self.wf.filter(
+                'fix cac', self.rows, lambda row: row['summary'],
+                session='summaries-{}'.format(MATCH_ALL),
+                item_id=RBFlow._row_id)])
+
+    def test_rows_added_and_removed(self):
+        self.assertSameAsFullScan('fi')
+        self.rows.append({'id': 99, 'summary': 'Fix fixtures',
+                          'last_updated': datetime(2021, 1, 1)})
+        self.assertSameAsFullScan('fix')
+        del self.rows[0]
+        self.assertSameAsFullScan('fix c')
+
+
+if __name__ == '__main__':
+    unittest.main()
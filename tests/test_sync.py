@@ -0,0 +1,157 @@
+# encoding: utf-8
+"""Views of the local review request store kept in sync with the server
+
+    python -m unittest discover tests
+"""
+from __future__ import unicode_literals
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from datetime import datetime
+from datetime import timedelta
+
+if sys.version_info[0] != 2:
+    raise unittest.SkipTest('the workflow runs on Python 2')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cr_store import ReviewRequest  # noqa: E402
+from rb_wrapper import FetchTimeout  # noqa: E402
+from reviewboard import FULL_SYNC_INTERVAL  # noqa: E402
+from reviewboard import RBFlow  # noqa: E402
+
+
+def request(id, submitter='alice', target_people=('me',)):
+    return ReviewRequest(
+        id=id, summary='Change {}'.format(id), status='pending',
+        submitter=submitter, repo='rbtools', time_added=datetime(2020, 1, 1),
+        last_updated=datetime(2020, 1, 1) + timedelta(hours=id),
+        ship_it_count=0, issue_open_count=0,
+        absolute_url='http://rb/r/{}/'.format(id),
+        target_people=list(target_people), primary_reviewers=[])
+
+
+class FakeWrapper(object):
+    """Answers syncs from ``self.rows``, the requests on the server"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.since = []
+        self.skip_reused = []
+
+    def _sync(self, since, keep, skip_reused):
+        self.since.append(since)
+        self.skip_reused.append(skip_reused)
+        rows = [row for row in self.rows if keep(row) and
+                (since is None or row['last_updated'] >= since)]
+        if not rows:
+            return rows, since
+        return rows, max(row['last_updated'] for row in rows)
+
+    def sync_cr_from(self, rows, since, username, skip_reused):
+        return self._sync(
+            since, lambda row: row['submitter'] == username, skip_reused)
+
+    def sync_cr_to(self, rows, since, username, skip_reused):
+        return self._sync(
+            since, lambda row: username in row['target_people'], skip_reused)
+
+
+class SyncViewTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.environ = dict(os.environ)
+        os.environ['alfred_workflow_data'] = os.path.join(self.tmp, 'data')
+        os.environ['alfred_workflow_cache'] = os.path.join(self.tmp, 'cache')
+        os.environ['alfred_workflow_bundleid'] = 'test.reviewboard'
+        self.flow = RBFlow()
+        self.store = self.flow.store
+
+    def tearDown(self):
+        self.store.close()
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.tmp)
+
+    def expire_full_sync(self, query):
+        self.store.conn.execute(
+            'UPDATE full_sync SET synced_at = ? WHERE query = ?',
+            (time.time() - FULL_SYNC_INTERVAL, query))
+
+    def test_incremental_until_full_sync_due(self):
+        wrapper = FakeWrapper([request(1), request(2)])
+        self.assertTrue(self.flow.sync_view(wrapper, 'to:me'))
+        self.assertTrue(self.flow.sync_view(wrapper, 'to:me'))
+        self.expire_full_sync('to:me')
+        self.assertTrue(self.flow.sync_view(wrapper, 'to:me'))
+        self.assertEqual(
+            wrapper.since, [None, datetime(2020, 1, 1, 2), None])
+        self.assertEqual(wrapper.skip_reused, [False, True, False])
+
+    def test_full_sync_drops_removed_reviewer(self):
+        wrapper = FakeWrapper([request(1), request(2)])
+        self.flow.sync_view(wrapper, 'to:me')
+        # taken off request 1 as reviewer, it shows in no sync of to:me
+        wrapper.rows[0] = request(1, target_people=['bob'])
+        self.flow.sync_view(wrapper, 'to:me')
+        self.assertEqual(
+            [row['id'] for row in self.store.requests(target='me')], [2, 1])
+
+        version = self.store.version()
+        self.expire_full_sync('to:me')
+        self.flow.sync_view(wrapper, 'to:me')
+        self.assertEqual(
+            [row['id'] for row in self.store.requests(target='me')], [2])
+        self.assertNotEqual(self.store.version(), version)
+        # still shown in the views of its submitter
+        self.assertEqual(
+            self.store.requests(submitter='alice')[1]['target_people'], [])
+
+    def test_full_sync_deletes_vanished_requests(self):
+        wrapper = FakeWrapper([request(1), request(2), request(3, 'bob')])
+        self.flow.sync_view(wrapper, 'from:alice')
+        self.flow.sync_view(wrapper, 'from:bob')
+        del wrapper.rows[0]  # deleted or made private
+        self.expire_full_sync('from:alice')
+        self.flow.sync_view(wrapper, 'from:alice')
+        self.assertEqual(
+            [row['id'] for row in self.store.requests()], [3, 2])
+        if self.store.fts:
+            self.assertEqual(
+                [row['id'] for row in self.store.requests(terms=['change'])],
+                [3, 2])
+
+    def test_timed_out_full_sync_keeps_rows(self):
+        wrapper = FakeWrapper([request(1), request(2)])
+        self.flow.sync_view(wrapper, 'to:me')
+        self.expire_full_sync('to:me')
+
+        def timeout(rows, since, username, skip_reused):
+            raise FetchTimeout([request(2)])
+        wrapper.sync_cr_to = timeout
+        self.assertFalse(self.flow.sync_view(wrapper, 'to:me'))
+        self.assertEqual(len(self.store.requests(target='me')), 2)
+        self.assertTrue(self.flow._full_sync_due('to:me'))
+
+    def test_no_skipping_after_incomplete_sync(self):
+        wrapper = FakeWrapper([request(1)])
+        self.flow.sync_view(wrapper, 'to:me')
+        sync_cr_to = wrapper.sync_cr_to
+
+        def timeout(rows, since, username, skip_reused):
+            raise FetchTimeout([])
+        wrapper.sync_cr_to = timeout
+        self.flow.sync_view(wrapper, 'to:me')
+        wrapper.sync_cr_to = sync_cr_to
+        self.flow.sync_view(wrapper, 'to:me')
+        self.flow.sync_view(wrapper, 'to:me')
+        self.assertEqual(wrapper.skip_reused, [False, False, True])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+# encoding: utf-8
+"""User autocomplete index (user_index.py) and RBFlow.search_user_name
+
+    python -m unittest discover tests
+"""
+from __future__ import unicode_literals
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+if sys.version_info[0] != 2:
+    raise unittest.SkipTest('the workflow runs on Python 2')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import user_index  # noqa: E402
+
+USERS = [
+    {'username': 'john.smith', 'fullname': 'John Smith'},
+    {'username': 'jane', 'fullname': 'Jane Doe'},
+    {'username': 'zoe', 'fullname': 'Zoë Ångström'},
+    {'username': 'nofullname', 'fullname': ''},
+    {'username': 'left', 'fullname': 'Left Company', 'deleted': True},
+]
+
+
+class UserIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'users.idx')
+        user_index.build(self.path, USERS)
+        self.index = user_index.UserIndex(self.path)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.tmp)
+
+    def usernames(self, query, limit=10):
+        return [row['username'] for row in self.index.search(query, limit)]
+
+    def test_get(self):
+        self.assertEqual(self.index.get('zoe'),
+                         {'username': 'zoe', 'fullname': 'Zoë Ångström'})
+        self.assertEqual(self.index.get('nofullname')['fullname'], '')
+        self.assertIsNone(self.index.get('john'))
+        self.assertIsNone(self.index.get('nobody'))
+
+    def test_get_deleted(self):
+        self.assertEqual(self.index.get('left'), {
+            'username': 'left', 'fullname': 'Left Company',
+            'deleted': True})
+
+    def test_prefix_before_substring(self):
+        self.assertEqual(self.usernames('j'), ['jane', 'john.smith'])
+        self.assertEqual(self.usernames('smi'), ['john.smith'])
+        self.assertEqual(self.usernames('ith'), ['john.smith'])
+        self.assertEqual(self.usernames('oe'), ['jane', 'zoe'])
+
+    def test_unicode(self):
+        self.assertEqual(self.usernames('ång'), ['zoe'])
+        self.assertEqual(self.usernames('Zoë'), ['zoe'])
+
+    def test_search_leaves_out_deleted(self):
+        self.assertEqual(self.usernames('left'), [])
+
+    def test_limit_and_empty_query(self):
+        self.assertEqual(len(self.usernames('', limit=2)), 2)
+        self.assertEqual(len(self.usernames('')), 4)
+        self.assertEqual(self.usernames('j', limit=1), ['jane'])
+
+    def test_no_users(self):
+        path = os.path.join(self.tmp, 'empty.idx')
+        user_index.build(path, [])
+        index = user_index.UserIndex(path)
+        self.assertEqual(index.search('a', 5), [])
+        self.assertIsNone(index.get('a'))
+        index.close()
+
+    def test_not_an_index(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'RBUIDX01' + b'\0' * 8)
+        self.assertRaises(ValueError, user_index.UserIndex, self.path)
+
+
+class SearchUserNameTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.environ = dict(os.environ)
+        os.environ['alfred_workflow_data'] = os.path.join(self.tmp, 'data')
+        os.environ['alfred_workflow_cache'] = os.path.join(self.tmp, 'cache')
+        os.environ['alfred_workflow_bundleid'] = 'test.reviewboard'
+        from reviewboard import RBFlow
+        self.flow = RBFlow()
+        wf = self.flow.wf
+        wf.cache_data('users', {user['username']: user for user in USERS})
+        wf.cache_data('users_list', sorted(
+            user['username'] for user in USERS if not user.get('deleted')))
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.tmp)
+
+    def usernames(self, query):
+        return [row['username']
+                for row in self.flow.search_user_name(query)]
+
+    def test_fuzzy(self):
+        self.assertEqual(self.usernames('jsmith'), ['john.smith'])
+        self.assertIn('john.smith', self.usernames('js'))
+
+    def test_prefix_first(self):
+        self.assertEqual(self.usernames('ja')[0], 'jane')
+
+    def test_recent_first_and_deleted_resolve(self):
+        self.flow.wf.store_data('recent_users', ['left', 'zoe'])
+        self.assertEqual(self.usernames('')[:2], ['left', 'zoe'])
+        self.assertEqual(self.usernames('left'), ['left'])
+
+    def test_old_index_is_rebuilt(self):
+        path = self.flow.wf.cachefile('users.idx')
+        with open(path, 'wb') as f:
+            f.write(b'RBUIDX01' + b'\0' * 8)
+        self.assertEqual(self.usernames('jane'), ['jane'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+"""On-disk sorted index of the user directory for autocomplete
+
+The file holds one record per lookup key: the lowercased username, the
+lowercased full name and each word of it. Records are sorted by key and
+preceded by a table of their offsets, so a prefix lookup is a binary
+search over the memory-mapped file and only reads the matching records.
+
+Users the server no longer lists are kept, flagged as deleted: ``get``
+still finds them, ``search`` leaves them out.
+
+Layout (integers are little-endian uint32)::
+
+    MAGIC | count | offset * count | record * count
+    record = key NUL username NUL fullname NUL flags LF
+
+where ``flags`` is ``d`` for deleted users and empty otherwise.
+"""
+import mmap
+import os
+import struct
+
+from workflow.workflow import atomic_writer
+
+MAGIC = b'RBUIDX02'
+HEADER = struct.Struct('<8sI')
+OFFSET = struct.Struct('<I')
+
+
+def _keys(user):
+    username = user['username'].lower()
+    fullname = (user.get('fullname') or '').lower()
+    keys = {username, fullname}
+    keys.update(fullname.split())
+    keys.discard('')
+    return keys
+
+
+def build(path, users):
+    """Write the index of ``users`` (dicts with 'username', 'fullname' and
+    optionally 'deleted') to ``path``, replacing any existing file
+    atomically.
+    """
+    records = sorted(
+        (key.encode('utf-8'),
+         user['username'].encode('utf-8'),
+         (user.get('fullname') or '').encode('utf-8'),
+         b'd' if user.get('deleted') else b'')
+        for user in users
+        for key in _keys(user))
+
+    heap = []
+    offsets = []
+    size = 0
+    for record in records:
+        line = b'\0'.join(record) + b'\n'
+        offsets.append(size)
+        heap.append(line)
+        size += len(line)
+
+    with atomic_writer(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(records)))
+        f.write(struct.pack('<{}I'.format(len(offsets)), *offsets))
+        f.write(b''.join(heap))
+
+
+class UserIndex(object):
+    """Read-only view of an index written by ``build``"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mtime = os.fstat(f.fileno()).st_mtime
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError('Not a user index: {}'.format(path))
+        self._heap = HEADER.size + OFFSET.size * self.count
+
+    def close(self):
+        self._mm.close()
+
+    def _offset(self, i):
+        return self._heap + OFFSET.unpack_from(
+            self._mm, HEADER.size + OFFSET.size * i)[0]
+
+    def _record(self, i):
+        start = self._offset(i)
+        end = self._mm.find(b'\n', start)
+        return self._mm[start:end].split(b'\0')
+
+    def _row(self, i):
+        _, username, fullname, flags = self._record(i)
+        row = {
+            'username': username.decode('utf-8'),
+            'fullname': fullname.decode('utf-8'),
+        }
+        if flags == b'd':
+            row['deleted'] = True
+        return row
+
+    def _bisect(self, key):
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._record(mid)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def get(self, username):
+        """Return the row of ``username``, deleted or not, or None"""
+        wanted = username.encode('utf-8')
+        wanted_key = username.lower().encode('utf-8')
+        i = self._bisect(wanted_key)
+        while i < self.count:
+            key, found = self._record(i)[:2]
+            if key != wanted_key:
+                return None
+            if found == wanted:
+                return self._row(i)
+            i += 1
+        return None
+
+    def search(self, query, limit):
+        """Return up to ``limit`` rows of users that are not deleted
+        matching ``query``
+
+        Users with a username, full name or name word starting with
+        ``query`` come first, in key order; the rest of the slots are
+        filled with users whose keys merely contain ``query``. Initials
+        and scattered characters are not matched here, see
+        RBFlow.search_user_name.
+        """
+        query = query.strip().lower().encode('utf-8')
+        seen = set()
+        rows = []
+
+        def _add(i):
+            row = self._row(i)
+            if row.get('deleted'):
+                return False
+            if row['username'] not in seen:
+                seen.add(row['username'])
+                rows.append(row)
+            return len(rows) >= limit
+
+        i = self._bisect(query)
+        while i < self.count and self._record(i)[0].startswith(query):
+            if _add(i):
+                return rows
+            i += 1
+
+        if not query:
+            return rows
+        # substring matches: search the mapped records directly and map
+        # each hit back to its record through the offset table
+        pos = self._mm.find(query, self._heap)
+        while pos != -1:
+            lo, hi = 0, self.count
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self._offset(mid) <= pos:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            record = lo - 1
+            if pos < self._offset(record) + len(self._record(record)[0]):
+                if _add(record):
+                    return rows
+            pos = self._mm.find(query, pos + 1)
+        return rows
@@ -13,7 +13,7 @@
 import os
 
 # Workflow objects
-from .workflow import Workflow, manager
+from .workflow import Workflow, FilterIndex, FilterKey, manager
 from .workflow3 import Variables, Workflow3
 
 # Exceptions
@@ -70,6 +70,8 @@ __all__ = [
     'Variables',
     'Workflow',
     'Workflow3',
+    'FilterIndex',
+    'FilterKey',
     'manager',
     'PasswordNotFound',
     'KeychainError',
@@ -0,0 +1,398 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+
+"""NumPy engine for :meth:`Workflow.filter <workflow.Workflow.filter>`.
+
+:meth:`Workflow._filter_matches` runs the ``MATCH_*`` rules item by
+item. This module runs each rule once over all items instead: the search
+keys are encoded as a matrix of code points (one row per key, padded with
+zeros to the longest key), so "starts with" and "contains" become array
+comparisons, and scores are computed from arrays of key lengths.
+
+:const:`~workflow.MATCH_ALLCHARS` is only run on arrays for ASCII keys
+and queries, where its case-insensitive regular expression is the same as
+finding the characters in order in the lowercase key. Other keys are
+tested item by item. In both cases only keys no other rule matched are
+tested.
+
+The arrays of the last list of :class:`~workflow.FilterKey` objects
+filtered are kept, and reused when the same keys, or some of them, are
+filtered again. So a process that keeps its keys between queries (see
+:meth:`Workflow.filter_key`) only builds them once.
+
+Results, scores and their order are identical to
+:meth:`Workflow._filter_matches`. :meth:`Workflow.filter` uses this
+engine for long item lists if NumPy can be imported and
+:attr:`Workflow.batch_filter <workflow.Workflow.batch_filter>` is set,
+see :const:`~workflow.workflow.BATCH_FILTER_THRESHOLD`. Building the
+arrays costs several times a Python scan of the same keys, so the engine
+only pays off where they are reused.
+
+"""
+
+from __future__ import print_function, unicode_literals
+
+import numpy
+
+from .workflow import (
+    FilterKey,
+    MATCH_ALLCHARS,
+    MATCH_ATOM,
+    MATCH_CAPITALS,
+    MATCH_INITIALS_CONTAIN,
+    MATCH_INITIALS_STARTSWITH,
+    MATCH_STARTSWITH,
+    MATCH_SUBSTRING,
+    isascii,
+)
+
+__all__ = ['filter_matches', 'supported']
+
+#: Arrays of the keys filtered last, see :func:`_columns_for`
+_last_columns = None
+
+
+def supported(words):
+    """Whether :func:`filter_matches` can score query ``words`` exactly.
+
+    Code point matrices are zero-padded and hold characters outside the
+    Basic Multilingual Plane as one code point, which narrow Python builds
+    store as two, so words containing such characters are not supported.
+
+    :param words: query words (see :meth:`Workflow._filter_words`)
+    :rtype: ``Boolean``
+
+    """
+    for word, _, _ in words:
+        for c in word:
+            n = ord(c)
+            if n == 0 or 0xd800 <= n < 0xe000 or n > 0xffff:
+                return False
+    return True
+
+
+def filter_matches(wf, words, pairs, match_on):
+    """Generate the matches :meth:`Workflow._filter_matches` would.
+
+    :param wf: :class:`~workflow.Workflow` whose :const:`MATCH_ALLCHARS`
+        test is used
+    :param words: query words (see :meth:`Workflow._filter_words`),
+        which must be :func:`supported`
+    :param pairs: ``(item, search_key)`` tuples
+    :type pairs: ``list``
+    :param match_on: ``MATCH_*`` rules to run
+    :returns: ``(sort_key, (item, score, rule))`` tuples in item order
+
+    """
+    if not pairs:
+        return
+
+    keys = []
+    for _, filter_key in pairs:
+        if not isinstance(filter_key, FilterKey):
+            filter_key = FilterKey(filter_key.strip())
+        keys.append(filter_key)
+    columns, positions = _columns_for(keys)
+
+    # ``alive`` are the rows, i.e. positions in ``columns``, of the
+    # items that matched every word so far
+    alive = positions[columns.nonempty[positions]]
+    score = numpy.zeros(len(columns.keys))
+    rule = numpy.zeros(len(columns.keys), dtype=int)
+    for word, chars, fold in words:
+        if not len(alive):
+            return
+        form = columns.form(fold)
+        matched, scores, rules = _score_word(wf, form, word, chars,
+                                             match_on, alive)
+        # items that don't match part of the query are skipped
+        keep = scores != 0
+        alive = matched[keep]
+        score[alive] += scores[keep]
+        rule[alive] = rules[keep]
+
+    # back to item order
+    order = numpy.flatnonzero(numpy.in1d(positions, alive))
+    for i in order:
+        row = positions[i]
+        item_score = float(score[row])
+        if item_score:
+            yield ((100.0 / item_score, keys[i].plain.lower, item_score),
+                   (pairs[i][0], item_score, int(rule[row])))
+
+
+def _columns_for(keys):
+    """Return :class:`_KeyColumns` containing ``keys`` and their rows.
+
+    Reuses the columns of the previous call if they contain all ``keys``,
+    otherwise replaces them with columns of ``keys``.
+
+    :returns: ``(columns, rows)``, where ``rows`` is an array of the row
+        of each key in ``columns``
+
+    """
+    global _last_columns
+    if _last_columns is not None:
+        rows = _last_columns.rows_of(keys)
+        if rows is not None:
+            return _last_columns, rows
+
+    _last_columns = _KeyColumns(keys)
+    return _last_columns, numpy.arange(len(keys))
+
+
+class _KeyColumns(object):
+    """Arrays of the parts of many :class:`~workflow.FilterKey` objects."""
+
+    def __init__(self, keys):
+        # the keys are kept, so their ``id`` stays unique
+        self.keys = keys
+        self._rows = dict((id(k), i) for i, k in enumerate(keys))
+        self.nonempty = numpy.array([k.value != '' for k in keys],
+                                    dtype=bool)
+        self._forms = {}
+
+    def rows_of(self, keys):
+        """Return array of the rows of ``keys`` or ``None`` if not all of
+        them are in the columns.
+        """
+        rows = [self._rows.get(id(k)) for k in keys]
+        if None in rows:
+            return None
+        return numpy.array(rows, dtype=int)
+
+    def form(self, fold):
+        """Return :class:`_FormColumns` of the folded or plain forms."""
+        if fold not in self._forms:
+            self._forms[fold] = _FormColumns(
+                [k.folded if fold else k.plain for k in self.keys])
+        return self._forms[fold]
+
+
+class _FormColumns(object):
+    """Arrays of the parts of one form of many search keys.
+
+    Each array is built when a rule first needs it.
+
+    """
+
+    def __init__(self, forms):
+        self.forms = forms
+        self._lower = None
+        self._length = None
+        self._charbits = None
+        self._capitals = None
+        self._atoms = None
+        self._initials = None
+        self._simple = None
+
+    @property
+    def lower(self):
+        """Lowercase keys."""
+        if self._lower is None:
+            self._lower = _CodePoints([f.lower for f in self.forms])
+        return self._lower
+
+    @property
+    def length(self):
+        """Length of keys."""
+        if self._length is None:
+            self._length = numpy.array([len(f.value) for f in self.forms])
+        return self._length
+
+    @property
+    def charbits(self):
+        """Characters of keys, as bits ``ord(c) % 64`` of integers."""
+        if self._charbits is None:
+            self._charbits = numpy.array(
+                [_charbits(f.chars) for f in self.forms], dtype=numpy.uint64)
+        return self._charbits
+
+    @property
+    def capitals(self):
+        """Capital letters of keys."""
+        if self._capitals is None:
+            self._capitals = _CodePoints([f.capitals for f in self.forms])
+        return self._capitals
+
+    @property
+    def atoms(self):
+        """Atoms of keys, each followed and preceded by a space."""
+        # atoms are alphanumeric, so spaces can't occur within one
+        if self._atoms is None:
+            self._atoms = _CodePoints(
+                [' {0} '.format(' '.join(f.atoms)) for f in self.forms])
+        return self._atoms
+
+    @property
+    def initials(self):
+        """Initials of keys."""
+        if self._initials is None:
+            self._initials = _CodePoints([f.initials for f in self.forms])
+        return self._initials
+
+
+    @property
+    def simple(self):
+        """Mask of keys that are ASCII and a single line."""
+        if self._simple is None:
+            self._simple = numpy.array(
+                [isascii(f.value) and '\n' not in f.value
+                 for f in self.forms], dtype=bool)
+        return self._simple
+
+
+class _CodePoints(object):
+    """Strings as a zero-padded matrix of code points."""
+
+    def __init__(self, strings):
+        array = numpy.array(strings, dtype='U')
+        # unicode arrays are UCS-4, i.e. 4 bytes per character
+        self.width = array.dtype.itemsize // 4
+        self.matrix = array.view(numpy.uint32).reshape(
+            len(strings), self.width)
+        self.length = numpy.array([len(s) for s in strings])
+
+    def startswith(self, query, rows):
+        """Mask of the strings in ``rows`` that start with ``query``."""
+        if len(query) > self.width:
+            return numpy.zeros(len(rows), dtype=bool)
+        head = self.matrix[rows, :len(query)]
+        return (head == _codes(query)).all(axis=1)
+
+    def contains(self, query, rows):
+        """Mask of the strings in ``rows`` that contain ``query``."""
+        if len(query) > self.width:
+            return numpy.zeros(len(rows), dtype=bool)
+        matrix = self.matrix[rows]
+        # one column per offset ``query`` may start at
+        offsets = self.width - len(query) + 1
+        found = numpy.ones((len(rows), offsets), dtype=bool)
+        for i, code in enumerate(_codes(query)):
+            found &= matrix[:, i:i + offsets] == code
+        return found.any(axis=1)
+
+    def find_in_order(self, query, rows):
+        """Find the characters of ``query`` in order in the strings in
+        ``rows``, each as early as possible.
+
+        :returns: arrays ``(found, end)``, a mask of the strings that
+            contain them and, for those, the position after the last one
+
+        """
+        matrix = self.matrix[rows]
+        columns = numpy.arange(self.width)
+        # position of the character found last, per string
+        end = numpy.zeros(len(rows), dtype=int)
+        found = numpy.ones(len(rows), dtype=bool)
+        for code in _codes(query):
+            candidates = (matrix == code) & (columns >= end[:, None])
+            found &= candidates.any(axis=1)
+            end = candidates.argmax(axis=1) + 1
+        return found, end
+
+
+def _codes(chars):
+    """Return code points of ``chars`` as an array."""
+    return numpy.array([ord(c) for c in chars], dtype=numpy.uint32)
+
+
+def _charbits(chars):
+    """Return ``chars`` as bits ``ord(c) % 64`` of an integer."""
+    bits = 0
+    for c in chars:
+        bits |= 1 << (ord(c) & 63)
+    return bits
+
+
+def _score_word(wf, form, word, chars, match_on, rows):
+    """Run the rules for query ``word`` on the keys in ``rows``.
+
+    Same as :meth:`Workflow._filter_form` for each key.
+
+    :param form: :class:`_FormColumns` ``word`` is matched against
+    :returns: arrays ``(rows, scores, rules)`` of the keys a rule
+        matched, in no particular order
+
+    """
+    # pre-filter any items that do not contain all characters of
+    # ``word``. Keys may share bits, but every rule except MATCH_ALLCHARS
+    # only matches keys with all of them anyway, and that one is
+    # run by Workflow._filter_form, which checks the characters itself.
+    bits = numpy.uint64(_charbits(chars))
+    todo = rows[(form.charbits[rows] & bits) == bits]
+
+    # ``/`` as in Workflow._filter_form, so that integer lengths are
+    # divided the same way (floor division on Python 2)
+    tests = []
+    if match_on & MATCH_STARTSWITH:
+        tests.append((MATCH_STARTSWITH,
+                      lambda r: form.lower.startswith(word, r),
+                      lambda r: 100.0 - (form.length[r] / len(word))))
+    if match_on & MATCH_CAPITALS:
+        tests.append((MATCH_CAPITALS,
+                      lambda r: form.capitals.startswith(word, r),
+                      lambda r: 100.0 - (form.capitals.length[r] /
+                                         len(word))))
+    if match_on & MATCH_ATOM:
+        tests.append((MATCH_ATOM,
+                      lambda r: form.atoms.contains(' {0} '.format(word), r),
+                      lambda r: 100.0 - (form.length[r] / len(word))))
+    if match_on & MATCH_INITIALS_STARTSWITH:
+        tests.append((MATCH_INITIALS_STARTSWITH,
+                      lambda r: form.initials.startswith(word, r),
+                      lambda r: 100.0 - (form.initials.length[r] /
+                                         len(word))))
+    if match_on & MATCH_INITIALS_CONTAIN:
+        tests.append((MATCH_INITIALS_CONTAIN,
+                      lambda r: form.initials.contains(word, r),
+                      lambda r: 95.0 - (form.initials.length[r] /
+                                        len(word))))
+    if match_on & MATCH_SUBSTRING:
+        tests.append((MATCH_SUBSTRING,
+                      lambda r: form.lower.contains(word, r),
+                      lambda r: 90.0 - (form.length[r] / len(word))))
+
+    matched = []
+    scores = []
+    rules = []
+    for match_rule, test, score in tests:
+        if not len(todo):
+            break
+        mask = test(todo)
+        hit = todo[mask]
+        matched.append(hit)
+        scores.append(score(hit))
+        rules.append(numpy.repeat(match_rule, len(hit)))
+        todo = todo[~mask]
+
+    if match_on & MATCH_ALLCHARS and len(todo) and isascii(word):
+        # the regex of Workflow._filter_form matches from the start of
+        # a single line key, so its score only depends on ``end``
+        simple = todo[form.simple[todo]]
+        found, end = form.lower.find_in_order(word, simple)
+        matched.append(simple[found])
+        scores.append(100.0 / (end[found] + 1))
+        rules.append(numpy.repeat(MATCH_ALLCHARS, found.sum()))
+        todo = todo[~form.simple[todo]]
+
+    if match_on & MATCH_ALLCHARS and len(todo):
+        hit = []
+        for row in todo:
+            s, _ = wf._filter_form(form.forms[row], word, MATCH_ALLCHARS,
+                                   chars)
+            if s:
+                hit.append((row, s))
+        if hit:
+            matched.append(numpy.array([row for row, _ in hit], dtype=int))
+            scores.append(numpy.array([s for _, s in hit]))
+            rules.append(numpy.repeat(MATCH_ALLCHARS, len(hit)))
+
+    if not matched:
+        return (numpy.zeros(0, dtype=int), numpy.zeros(0),
+                numpy.zeros(0, dtype=int))
+    return (numpy.concatenate(matched), numpy.concatenate(scores),
+            numpy.concatenate(rules))
@@ -26,7 +26,6 @@ from __future__ import print_function, unicode_literals
 import os
 import tempfile
 import re
-import subprocess
 
 import workflow
 import web
@@ -388,6 +387,8 @@ def install_update():
     local_file = download_workflow(update_data['download_url'])
 
     wf().logger.info('installing updated workflow ...')
+    # imported here: Workflow.run imports this module for Version
+    import subprocess
     subprocess.call(['open', local_file])
 
     update_data['available'] = False
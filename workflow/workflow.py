@@ -26,10 +26,14 @@ import binascii
 from contextlib import contextmanager
 import cPickle
 from copy import deepcopy
+from datetime import datetime, timedelta
 import errno
+from io import BytesIO
+import heapq
 import json
 import logging
 import logging.handlers
+import marshal
 import os
 import pickle
 import plistlib
@@ -37,7 +41,6 @@ import re
 import shutil
 import signal
 import string
-import subprocess
 import sys
 import time
 import unicodedata
@@ -433,6 +436,12 @@ MATCH_ALLCHARS = 64
 #: Combination of all other ``MATCH_*`` constants
 MATCH_ALL = 127
 
+#: Number of items from which :meth:`Workflow.filter` scores them with
+#: the NumPy engine in :mod:`workflow.batchfilter`, if NumPy is installed
+#: and :attr:`Workflow.batch_filter` is set. Set to ``0`` to always score
+#: items one by one.
+BATCH_FILTER_THRESHOLD = 5000
+
 
 ####################################################################
 # Used by `Workflow.check_update`
@@ -499,6 +508,19 @@ def isascii(text):
     return True
 
 
+def fold_to_ascii(text):
+    """Convert non-ASCII characters to closest ASCII equivalent.
+
+    See :meth:`Workflow.fold_to_ascii`.
+
+    """
+    if isascii(text):
+        return text
+    text = ''.join([ASCII_REPLACEMENTS.get(c, c) for c in text])
+    return unicode(unicodedata.normalize('NFKD',
+                   text).encode('ascii', 'ignore'))
+
+
 ####################################################################
 # Implementation classes
 ####################################################################
@@ -699,11 +721,431 @@ class PickleSerializer(object):
         return pickle.dump(obj, file_obj, protocol=-1)
 
 
+class MarshalSerializer(object):
+    """Wrapper around :mod:`marshal` that also handles ``datetime``.
+
+    Loads faster than ``cPickle`` and, for lists of records, writes
+    smaller files.
+
+    Only built-in types (``None``, numbers, strings, lists, tuples,
+    dicts and sets) and naive ``datetime`` objects are supported. Data
+    :mod:`marshal` handles as is are stored as is. Otherwise, datetimes
+    are stored as integer microseconds since the epoch, and lists of dicts
+    that all have the same keys, such as a list of records, are stored as
+    one list per key. Only the containers that hold such values are
+    rebuilt on loading; everything else is loaded by :mod:`marshal`.
+
+    """
+
+    #: Start of every file: magic number, then ``E`` if the data were
+    #: encoded, ``-`` otherwise
+    MAGIC = b'AWM1'
+
+    _epoch = datetime(1970, 1, 1)
+    # Encoded values are tuples starting with one of these tags
+    _DATETIME = '\x00datetime'
+    _DATETIMES = '\x00datetimes'
+    _ITEMS = '\x00items'
+    _DICT = '\x00dict'
+    _TABLE = '\x00table'
+    _types = {'list': list, 'tuple': tuple, 'set': set,
+              'frozenset': frozenset}
+
+    @classmethod
+    def load(cls, file_obj):
+        """Load serialized object from open marshal file.
+
+        :param file_obj: file handle
+        :type file_obj: ``file`` object
+        :returns: object loaded from marshal file
+        :rtype: object
+
+        """
+        header = file_obj.read(len(cls.MAGIC) + 1)
+        if header[:len(cls.MAGIC)] != cls.MAGIC:
+            raise ValueError('not a marshal data file')
+        obj = marshal.loads(file_obj.read())
+        if header[-1:] == b'E':
+            obj = cls._decode(obj)
+        return obj
+
+    @classmethod
+    def dump(cls, obj, file_obj):
+        """Serialize object ``obj`` to open marshal file.
+
+        :param obj: Python object to serialize
+        :type obj: built-in types and naive ``datetime``
+        :param file_obj: file handle
+        :type file_obj: ``file`` object
+
+        """
+        try:
+            data, flag = marshal.dumps(obj, 2), b'-'
+        except ValueError:  # e.g. datetimes, encode them
+            encoded, _ = cls._encode(obj)
+            data, flag = marshal.dumps(encoded, 2), b'E'
+        file_obj.write(cls.MAGIC + flag)
+        file_obj.write(data)
+
+    @classmethod
+    def _micros(cls, dt):
+        """Return naive datetime ``dt`` as microseconds since the epoch."""
+        if dt.tzinfo is not None:
+            raise ValueError('cannot marshal timezone-aware datetime')
+        delta = dt - cls._epoch
+        return ((delta.days * 86400 + delta.seconds) * 1000000 +
+                delta.microseconds)
+
+    @classmethod
+    def _encode(cls, obj):
+        """Return ``(value, encoded)``.
+
+        ``value`` is ``obj`` with datetimes and tables replaced, ``encoded``
+        whether :meth:`_decode` must be called on it.
+
+        """
+        type_ = type(obj)
+        if isinstance(obj, datetime):
+            return (cls._DATETIME, cls._micros(obj)), True
+
+        if type_ is dict:
+            items, encoded = cls._encode(obj.items())
+            if encoded:
+                return (cls._DICT, items), True
+            return obj, False
+
+        if type_ is list and len(obj) > 1 and all(
+                type(v) is dict for v in obj):
+            keys = obj[0].keys()
+            key_set = set(keys)
+            if keys and all(len(v) == len(keys) and key_set.issuperset(v)
+                            for v in obj):
+                return cls._encode_table(keys, obj)
+
+        if type_ in (list, tuple, set, frozenset):
+            values = []
+            indices = []
+            for i, value in enumerate(obj):
+                value, encoded = cls._encode(value)
+                values.append(value)
+                if encoded:
+                    indices.append(i)
+            if indices:
+                return (cls._ITEMS, type_.__name__, values, indices), True
+            return obj, False
+
+        return obj, False
+
+    @classmethod
+    def _encode_table(cls, keys, rows):
+        """Encode list of dicts ``rows`` with ``keys`` as one list per key."""
+        columns = []
+        indices = []
+        for i, key in enumerate(keys):
+            column = [row[key] for row in rows]
+            if all(v is None or isinstance(v, datetime) for v in column):
+                column = (cls._DATETIMES, [
+                    None if v is None else cls._micros(v) for v in column])
+                encoded = True
+            else:
+                column, encoded = cls._encode(column)
+            columns.append(column)
+            if encoded:
+                indices.append(i)
+        return (cls._TABLE, keys, columns, indices), True
+
+    @classmethod
+    def _decode(cls, obj):
+        """Turn a value returned by :meth:`_encode` back into the original."""
+        tag = obj[0]
+        if tag == cls._DATETIME:
+            return cls._epoch + timedelta(microseconds=obj[1])
+
+        if tag == cls._DATETIMES:
+            epoch = cls._epoch
+            return [None if v is None else epoch + timedelta(microseconds=v)
+                    for v in obj[1]]
+
+        if tag == cls._DICT:
+            return dict(cls._decode(obj[1]))
+
+        _, name, values, indices = obj
+        for i in indices:
+            values[i] = cls._decode(values[i])
+
+        if tag == cls._TABLE:
+            return [dict(zip(name, row)) for row in zip(*values)]
+
+        return values if name == 'list' else cls._types[name](values)
+
+
 # Set up default manager and register built-in serializers
 manager = SerializerManager()
 manager.register('cpickle', CPickleSerializer)
 manager.register('pickle', PickleSerializer)
 manager.register('json', JSONSerializer)
+manager.register('marshal', MarshalSerializer)
+
+#: Start of a compressed cache or data file. It is followed by the name of
+#: the codec and a newline, then the compressed output of the serializer.
+COMPRESSED_MAGIC = b'AWZ1'
+
+#: Codecs for compressed cache and data files, see
+#: :meth:`Workflow.cache_data`. All are set to their fastest level.
+#: ``lzma`` needs Python 3 or the ``backports.lzma`` package.
+COMPRESSION_CODECS = ('zlib', 'bz2', 'lzma')
+
+
+def _codec(name):
+    """Return module implementing compression codec ``name``."""
+    if name not in COMPRESSION_CODECS:
+        raise ValueError('Unknown compression codec `{0}`. Use one of '
+                         '{1}'.format(name, ', '.join(COMPRESSION_CODECS)))
+    try:
+        if name == 'lzma':
+            try:
+                import lzma
+            except ImportError:
+                from backports import lzma
+            return lzma
+        return __import__(str(name))
+    except ImportError:
+        raise ValueError('Compression codec `{0}` is not '
+                         'available'.format(name))
+
+
+def dump_file(serializer, data, file_obj, compression=None):
+    """Serialize ``data`` to ``file_obj``, compressed with ``compression``.
+
+    :param serializer: serializer object, see :class:`SerializerManager`
+    :param data: object to serialize
+    :param file_obj: file handle
+    :param compression: name of a codec in :data:`COMPRESSION_CODECS`
+        or ``None`` to write the output of ``serializer`` as is
+
+    """
+    if not compression:
+        serializer.dump(data, file_obj)
+        return
+
+    codec = _codec(compression)
+    buf = BytesIO()
+    serializer.dump(data, buf)
+    if compression == 'lzma':
+        compressed = codec.compress(buf.getvalue(), preset=0)
+    else:
+        compressed = codec.compress(buf.getvalue(), 1)
+    file_obj.write(COMPRESSED_MAGIC + compression.encode('ascii') + b'\n')
+    file_obj.write(compressed)
+
+
+def load_file(serializer, file_obj):
+    """Load data written by :func:`dump_file`.
+
+    :param serializer: serializer object, see :class:`SerializerManager`
+    :param file_obj: file handle
+    :returns: ``(data, compression)``, where ``compression`` is the codec
+        the file was compressed with or ``None``
+
+    """
+    if file_obj.read(len(COMPRESSED_MAGIC)) != COMPRESSED_MAGIC:
+        file_obj.seek(0)
+        return serializer.load(file_obj), None
+
+    compression = file_obj.readline().strip().decode('ascii')
+    raw = _codec(compression).decompress(file_obj.read())
+    return serializer.load(BytesIO(raw)), compression
+
+
+class FilterKey(object):
+    """Query-independent parts of a :meth:`Workflow.filter` search key.
+
+    :meth:`Workflow.filter` folds, lowercases and splits every item's
+    search key before comparing it with the query. Build a
+    :class:`FilterKey` once per item with :meth:`Workflow.filter_key`
+    and return it from the ``key`` function passed to
+    :meth:`~Workflow.filter`, and each search only runs the comparisons.
+
+    Instances can be pickled, so they may be cached next to the items
+    they belong to with :meth:`Workflow.cache_data` if
+    :attr:`~Workflow.cache_serializer` is ``cpickle`` or ``pickle``. The
+    ``json`` and ``marshal`` serializers can't store them.
+
+    """
+
+    __slots__ = ('value', 'plain', '_folded')
+
+    def __init__(self, value):
+        """Create new :class:`FilterKey`.
+
+        Parts are computed when first needed, call :meth:`compile` to
+        compute all of them up front.
+
+        :param value: search key, stripped of surrounding whitespace
+        :type value: ``unicode``
+
+        """
+        self.value = value
+        self.plain = _FilterKeyForm(value)
+        self._folded = None
+
+    @property
+    def folded(self):
+        """Key parts of ``value`` folded to ASCII."""
+        if self._folded is None:
+            if isascii(self.value):
+                self._folded = self.plain
+            else:
+                self._folded = _FilterKeyForm(fold_to_ascii(self.value))
+        return self._folded
+
+    def compile(self):
+        """Compute all parts now, e.g. before caching the key.
+
+        :returns: ``self``
+
+        """
+        for form in (self.plain, self.folded):
+            form.capitals, form.atoms, form.initials
+        return self
+
+    def __getstate__(self):
+        """Return state for pickling."""
+        return (self.value, self.plain, self._folded)
+
+    def __setstate__(self, state):
+        """Restore state from pickle."""
+        self.value, self.plain, self._folded = state
+
+
+class _FilterKeyForm(object):
+    """The parts of one form (as is or ASCII-folded) of a search key."""
+
+    __slots__ = ('value', 'lower', 'chars', '_capitals', '_atoms')
+
+    def __init__(self, value):
+        self.value = value
+        self.lower = value.lower()
+        self.chars = frozenset(self.lower)
+        self._capitals = None
+        self._atoms = None
+
+    @property
+    def capitals(self):
+        """Capital letters, e.g. "of" for "OmniFocus"."""
+        if self._capitals is None:
+            self._capitals = ''.join(
+                [c for c in self.value if c in INITIALS]).lower()
+        return self._capitals
+
+    @property
+    def atoms(self):
+        """"Words" separated by spaces or other non-word characters."""
+        if self._atoms is None:
+            atoms = [s.lower() for s in split_on_delimiters(self.value)]
+            self._atoms = (atoms, ''.join([s[0] for s in atoms if s]))
+        return self._atoms[0]
+
+    @property
+    def initials(self):
+        """Initials of the :attr:`atoms`."""
+        self.atoms
+        return self._atoms[1]
+
+    def __getstate__(self):
+        """Return state for pickling."""
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        """Restore state from pickle."""
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+
+class FilterIndex(object):
+    """N-gram index over the search keys of items for :meth:`Workflow.filter`.
+
+    Pass it to :meth:`~Workflow.filter` via its ``index`` argument and only
+    items whose search keys contain all characters of the query (and, for
+    rules that match contiguous text, all its trigrams) are scored. Worth
+    building when the same large list of items is filtered many times.
+
+    The index holds the items it was built from and their
+    :class:`FilterKey` objects.
+
+    """
+
+    #: Rules that only match keys containing the query as contiguous text
+    CONTIGUOUS_RULES = MATCH_STARTSWITH | MATCH_ATOM | MATCH_SUBSTRING
+
+    def __init__(self, items, key=lambda x: x):
+        """Create new :class:`FilterIndex`.
+
+        :param items: items to index
+        :type items: ``list`` or ``tuple``
+        :param key: function to get search key from ``items``, as for
+            :meth:`Workflow.filter`
+        :type key: ``callable``
+
+        """
+        self.items = list(items)
+        self.keys = []
+        self._postings = {}
+        for i, item in enumerate(self.items):
+            filter_key = key(item)
+            if not isinstance(filter_key, FilterKey):
+                filter_key = FilterKey(filter_key.strip())
+            self.keys.append(filter_key)
+            grams = set()
+            # a query word is matched against either form, so index both
+            for form in (filter_key.plain, filter_key.folded):
+                grams.update(form.chars)
+                grams.update(_trigrams(form.lower))
+            for gram in grams:
+                self._postings.setdefault(gram, set()).add(i)
+
+    def __len__(self):
+        """Number of indexed items."""
+        return len(self.items)
+
+    def candidates(self, words, match_on):
+        """Return ``(item, key)`` pairs of items that may match ``words``.
+
+        Every rule only matches keys containing all characters of a query
+        word, and the rules in :attr:`CONTIGUOUS_RULES` only keys containing
+        the word itself, so no item that could match is left out.
+
+        :param words: query words (see :meth:`Workflow._filter_words`)
+        :param match_on: ``MATCH_*`` rules that will be run
+        :returns: ``(item, FilterKey)`` tuples in index order
+        :rtype: ``list``
+
+        """
+        contiguous = not match_on & ~self.CONTIGUOUS_RULES
+        grams = set()
+        for word, chars, _ in words:
+            grams.update(chars)
+            if contiguous:
+                grams.update(_trigrams(word))
+
+        postings = sorted([self._postings.get(g, set()) for g in grams],
+                          key=len)
+        if not postings:
+            positions = range(len(self.items))
+        else:
+            found = set(postings[0])
+            for posting in postings[1:]:
+                if not found:
+                    break
+                found &= posting
+            positions = sorted(found)
+
+        return [(self.items[i], self.keys[i]) for i in positions]
+
+
+def _trigrams(text):
+    """Return the set of 3-character substrings of ``text``."""
+    return set([text[i:i + 3] for i in range(len(text) - 2)])
 
 
 class Item(object):
@@ -929,17 +1371,20 @@ def atomic_writer(file_path, mode):
     :type mode: string
 
     """
-    temp_suffix = '.aw.temp'
+    # one temporary file per process, so processes writing the same file
+    # at once don't write into each other's
+    temp_suffix = '.{}.aw.temp'.format(os.getpid())
     temp_file_path = file_path + temp_suffix
-    with open(temp_file_path, mode) as file_obj:
-        try:
+    try:
+        # closed before the rename, so readers never see unflushed data
+        with open(temp_file_path, mode) as file_obj:
             yield file_obj
-            os.rename(temp_file_path, file_path)
-        finally:
-            try:
-                os.remove(temp_file_path)
-            except (OSError, IOError):
-                pass
+        os.rename(temp_file_path, file_path)
+    finally:
+        try:
+            os.remove(temp_file_path)
+        except (OSError, IOError):
+            pass
 
 
 class uninterruptible(object):
@@ -1163,6 +1608,15 @@ class Workflow(object):
         self._last_version_run = UNSET
         # Cache for regex patterns created for filter keys
         self._search_pattern_cache = {}
+        #: Names of caches :meth:`cached_data` returned stale data for
+        #: while a background job refreshes them
+        self.refreshing = set()
+        #: Whether :meth:`filter` may score long lists with the NumPy
+        #: engine (see :const:`BATCH_FILTER_THRESHOLD`). Importing NumPy
+        #: and building its arrays costs more than scoring the items one
+        #: by one, so it only pays off in a long-running process that
+        #: filters the same keys again.
+        self.batch_filter = False
         # Magic arguments
         #: The prefix for all magic arguments. Default is ``workflow:``
         self.magic_prefix = 'workflow:'
@@ -1659,6 +2113,18 @@ class Workflow(object):
                                       self._default_settings)
         return self._settings
 
+    def reload_settings(self):
+        """Read :attr:`settings` from :attr:`settings_path` again.
+
+        For long-running processes, whose settings may have been changed
+        by other runs of the workflow meanwhile.
+
+        :returns: :class:`~workflow.workflow.Settings` instance
+
+        """
+        self._settings = None
+        return self.settings
+
     @property
     def cache_serializer(self):
         """Name of default cache serializer.
@@ -1776,21 +2242,47 @@ class Workflow(object):
         filename = '{0}.{1}'.format(name, serializer_name)
         data_path = self.datafile(filename)
 
-        if not os.path.exists(data_path):
-            self.logger.debug('no data stored: %s', name)
-            if os.path.exists(metadata_path):
+        try:
+            with open(data_path, 'rb') as file_obj:
+                data, compression = load_file(serializer, file_obj)
+        except IOError as err:
+            if err.errno != errno.ENOENT:
+                raise
+            try:
+                with open(metadata_path, 'rb') as file_obj:
+                    if file_obj.read().strip() != serializer_name:
+                        # moved to another serializer meanwhile, see below
+                        return self.stored_data(name)
                 os.unlink(metadata_path)
-
+            except (IOError, OSError) as err:
+                if err.errno != errno.ENOENT:
+                    raise
+            self.logger.debug('no data stored: %s', name)
             return None
 
-        with open(data_path, 'rb') as file_obj:
-            data = serializer.load(file_obj)
-
         self.logger.debug('stored data loaded: %s', data_path)
 
+        # Move data written with the former default serializer to the
+        # current one. Other serializers were passed to `store_data`
+        # explicitly and are kept. Overlapping runs of the workflow may
+        # load the same data at once, so only one of them moves it.
+        if (serializer_name == 'cpickle' and
+                self.data_serializer != 'cpickle'):
+            new_path = self.datafile(
+                '{0}.{1}'.format(name, self.data_serializer))
+            with LockFile(data_path):
+                # gone if another process moved it meanwhile
+                if (os.path.exists(data_path) and
+                        self._convert_data(data, data_path, new_path,
+                                           self.data_serializer,
+                                           compression)):
+                    with atomic_writer(metadata_path, 'wb') as file_obj:
+                        file_obj.write(self.data_serializer)
+                    os.unlink(data_path)
+
         return data
 
-    def store_data(self, name, data, serializer=None):
+    def store_data(self, name, data, serializer=None, compression=None):
         """Save data to data directory.
 
         .. versionadded:: 1.8
@@ -1805,6 +2297,9 @@ class Workflow(object):
         :param serializer: name of serializer to use. If no serializer
             is specified, the default will be used. See
             :class:`SerializerManager` for more information.
+        :param compression: name of a codec in :data:`COMPRESSION_CODECS`
+            to compress the file with. Compressed files are recognised by
+            their header, so :meth:`stored_data` reads them either way.
         :returns: data in datastore or ``None``
 
         """
@@ -1851,61 +2346,105 @@ class Workflow(object):
                 file_obj.write(serializer_name)
 
             with atomic_writer(data_path, 'wb') as file_obj:
-                serializer.dump(data, file_obj)
+                dump_file(serializer, data, file_obj, compression)
 
         _store()
 
         self.logger.debug('saved data: %s', data_path)
 
-    def cached_data(self, name, data_func=None, max_age=60):
+    def cached_data(self, name, data_func=None, max_age=60, refresh=None,
+                    compression=None):
         """Return cached data if younger than ``max_age`` seconds.
 
         Retrieve data from cache or re-generate and re-cache data if
         stale/non-existant. If ``max_age`` is 0, return cached data no
         matter how old.
 
+        With ``refresh`` (stale-while-revalidate), stale data is returned
+        as is and ``refresh`` is run in the background instead of calling
+        ``data_func``, so a slow ``data_func`` never holds up a query.
+        The job must cache the fresh data under ``name`` itself. Only one
+        refresh per ``name`` runs at a time, and ``name`` is added to
+        :attr:`refreshing` while it does. ``data_func`` is still called if
+        there is no cached data at all.
+
         :param name: name of datastore
         :param data_func: function to (re-)generate data.
         :type data_func: ``callable``
         :param max_age: maximum age of cached data in seconds
         :type max_age: ``int``
+        :param refresh: command to refresh the data, passed to
+            :func:`~workflow.background.run_in_background`
+        :type refresh: ``list``
+        :param compression: codec to compress the data returned by
+            ``data_func`` with, see :meth:`cache_data`
         :returns: cached data, return value of ``data_func`` or ``None``
             if ``data_func`` is not set
 
         """
         serializer = manager.serializer(self.cache_serializer)
 
-        cache_path = self.cachefile('%s.%s' % (name, self.cache_serializer))
+        cache_path = self._cache_path(name)
         age = self.cached_data_age(name)
 
-        if (age < max_age or max_age == 0) and os.path.exists(cache_path):
+        if os.path.exists(cache_path) and (
+                age < max_age or max_age == 0 or refresh):
+            if refresh and max_age and age >= max_age:
+                self.refresh_in_background(name, refresh)
 
             with open(cache_path, 'rb') as file_obj:
                 self.logger.debug('loading cached data: %s', cache_path)
-                return serializer.load(file_obj)
+                return load_file(serializer, file_obj)[0]
 
         if not data_func:
             return None
 
         data = data_func()
-        self.cache_data(name, data)
+        self.cache_data(name, data, compression=compression)
 
         return data
 
-    def cache_data(self, name, data):
+    def refresh_in_background(self, name, args):
+        """Refresh stale data ``name`` by running ``args`` in the background.
+
+        Starts job ``refresh-<name>`` unless it is already running and adds
+        ``name`` to :attr:`refreshing`.
+
+        :param name: name of the stale data
+        :param args: command to run, as for
+            :func:`~workflow.background.run_in_background`
+        :type args: ``list``
+
+        """
+        from .background import is_running, run_in_background
+        job = 'refresh-' + name
+        if not is_running(job):
+            self.logger.debug('refreshing cache in background: %s', name)
+            run_in_background(job, args)
+        self.refreshing.add(name)
+
+    def cache_data(self, name, data, compression=None):
         """Save ``data`` to cache under ``name``.
 
         If ``data`` is ``None``, the corresponding cache file will be
         deleted.
 
+        With ``compression``, the file is compressed with that codec and
+        starts with a header naming it, so :meth:`cached_data` reads
+        compressed and uncompressed caches alike. Compression pays off for
+        large caches on slow disks; ``benchmarks/compression.py`` shows
+        where.
+
         :param name: name of datastore
         :param data: data to store. This may be any object supported by
                 the cache serializer
+        :param compression: name of a codec in :data:`COMPRESSION_CODECS`
+            or ``None`` to store the data uncompressed
 
         """
         serializer = manager.serializer(self.cache_serializer)
 
-        cache_path = self.cachefile('%s.%s' % (name, self.cache_serializer))
+        cache_path = self._cache_path(name)
 
         if data is None:
             if os.path.exists(cache_path):
@@ -1914,10 +2453,80 @@ class Workflow(object):
             return
 
         with atomic_writer(cache_path, 'wb') as file_obj:
-            serializer.dump(data, file_obj)
+            dump_file(serializer, data, file_obj, compression)
 
         self.logger.debug('cached data: %s', cache_path)
 
+    def _cache_path(self, name):
+        """Return path of cache ``name`` in :attr:`cache_serializer` format.
+
+        A cache written with another serializer, i.e. before
+        :attr:`cache_serializer` was changed, is converted to the current
+        format, keeping its age. Only one of several processes converts
+        it, the others find it converted.
+
+        :param name: name of datastore
+        :returns: path of cache file, which may not exist
+
+        """
+        cache_path = self.cachefile('%s.%s' % (name, self.cache_serializer))
+        if os.path.exists(cache_path):
+            return cache_path
+
+        for serializer_name in manager.serializers:
+            old_path = self.cachefile('%s.%s' % (name, serializer_name))
+            if old_path == cache_path or not os.path.exists(old_path):
+                continue
+
+            with LockFile(old_path):
+                # converted or deleted by another process meanwhile
+                if (os.path.exists(cache_path) or
+                        not os.path.exists(old_path)):
+                    break
+                st = os.stat(old_path)
+                try:
+                    with open(old_path, 'rb') as file_obj:
+                        data, compression = load_file(
+                            manager.serializer(serializer_name), file_obj)
+                except Exception as err:  # unreadable, treat as missing
+                    self.logger.debug('cannot load cache %s: %s',
+                                      old_path, err)
+                    os.unlink(old_path)
+                    break
+                if self._convert_data(data, old_path, cache_path,
+                                      self.cache_serializer, compression):
+                    os.utime(cache_path, (st.st_atime, st.st_mtime))
+                    os.unlink(old_path)
+            break
+
+        return cache_path
+
+    def _convert_data(self, data, old_path, new_path, serializer_name,
+                      compression=None):
+        """Write ``data`` loaded from ``old_path`` to ``new_path``.
+
+        ``data`` are serialized with ``serializer_name`` in memory first,
+        so ``new_path`` is not touched if the serializer can't handle them.
+        ``old_path`` is left for the caller to delete.
+
+        :returns: ``True`` if ``new_path`` was written, else ``False``
+
+        """
+        buf = BytesIO()
+        try:
+            dump_file(manager.serializer(serializer_name), data, buf,
+                      compression)
+        except Exception as err:
+            self.logger.warning('cannot convert %s to %s: %s',
+                                old_path, serializer_name, err)
+            return False
+
+        with atomic_writer(new_path, 'wb') as file_obj:
+            file_obj.write(buf.getvalue())
+
+        self.logger.debug('converted %s to %s', old_path, new_path)
+        return True
+
     def cached_data_fresh(self, name, max_age):
         """Whether cache `name` is less than `max_age` seconds old.
 
@@ -1944,7 +2553,7 @@ class Workflow(object):
         :rtype: ``int``
 
         """
-        cache_path = self.cachefile('%s.%s' % (name, self.cache_serializer))
+        cache_path = self._cache_path(name)
 
         if not os.path.exists(cache_path):
             return 0
@@ -1953,7 +2562,7 @@ class Workflow(object):
 
     def filter(self, query, items, key=lambda x: x, ascending=False,
                include_score=False, min_score=0, max_results=0,
-               match_on=MATCH_ALL, fold_diacritics=True):
+               match_on=MATCH_ALL, fold_diacritics=True, index=None):
         """Fuzzy search filter. Returns list of ``items`` that match ``query``.
 
         ``query`` is case-insensitive. Any item that does not contain the
@@ -1967,8 +2576,8 @@ class Workflow(object):
         :param items: iterable of items to test
         :type items: ``list`` or ``tuple``
         :param key: function to get comparison key from ``items``.
-            Must return a ``unicode`` string. The default simply returns
-            the item.
+            Must return a ``unicode`` string or a :class:`FilterKey`
+            (see :meth:`filter_key`). The default simply returns the item.
         :type key: ``callable``
         :param ascending: set to ``True`` to get worst matches first
         :type ascending: ``Boolean``
@@ -1980,6 +2589,8 @@ class Workflow(object):
             than this.
         :type min_score: ``int``
         :param max_results: If non-zero, prune results list to this length.
+            Only this many results are kept while matching, so a small
+            value makes filtering large lists cheaper.
         :type max_results: ``int``
         :param match_on: Filter option flags. Bitwise-combined list of
             ``MATCH_*`` constants (see below).
@@ -1987,6 +2598,10 @@ class Workflow(object):
         :param fold_diacritics: Convert search keys to ASCII-only
             characters if ``query`` only contains ASCII characters.
         :type fold_diacritics: ``Boolean``
+        :param index: index built from ``items`` and ``key``. If given,
+            only items that can match ``query`` according to the index
+            are tested.
+        :type index: :class:`FilterIndex`
         :returns: list of ``items`` matching ``query`` or list of
             ``(item, score, rule)`` `tuples` if ``include_score`` is ``True``.
             ``rule`` is the ``MATCH_*`` rule that matched the item.
@@ -2037,6 +2652,13 @@ class Workflow(object):
         To match only on startswith and substring, use
         ``match_on=MATCH_STARTSWITH | MATCH_SUBSTRING``.
 
+        **Long lists**
+
+        If :attr:`batch_filter` is set, the rules are run over all items
+        at once with NumPy from :const:`BATCH_FILTER_THRESHOLD` items on,
+        if it is installed (see :mod:`workflow.batchfilter`). Results are
+        the same.
+
         **Diacritic folding**
 
         .. versionadded:: 1.3
@@ -2065,50 +2687,188 @@ class Workflow(object):
         fold_diacritics = self.settings.get('__workflow_diacritic_folding',
                                             fold_diacritics)
 
-        results = []
+        words = self._filter_words(query, fold_diacritics)
+        if index is not None:
+            pairs = index.candidates(words, match_on)
+        else:
+            pairs = [(item, key(item)) for item in items]
+        matches = self._score_matches(words, pairs, match_on)
+        return self._filter_results(matches, ascending, include_score,
+                                    min_score, max_results)
+
+    def filter_fields(self, query, items, keys, ascending=False,
+                      include_score=False, min_score=0, max_results=0,
+                      match_on=MATCH_ALL, fold_diacritics=True):
+        """Like :meth:`filter`, but match ``query`` against several
+        weighted search keys per item.
+
+        Each word of ``query`` is scored against every search key of an
+        item with the same rules as :meth:`filter`, and its score is the
+        best score times the key's weight. Different words may match
+        different keys, e.g. ``foo bar`` matches an item with key
+        ``foo`` and key ``bar``. Items are rejected if a word matches
+        none of their keys.
+
+        :param keys: function returning the ``(search_key, weight)``
+            pairs of an item. Search keys may be ``unicode`` strings or
+            :class:`FilterKey` objects, weights are positive numbers;
+            keys with weight ``0`` are skipped.
+        :type keys: ``callable``
+        :returns: list of ``items`` matching ``query`` or list of
+            ``(item, score, rule)`` `tuples` if ``include_score`` is
+            ``True``.
+        :rtype: ``list``
 
-        for item in items:
-            skip = False
-            score = 0
-            words = [s.strip() for s in query.split(' ')]
-            value = key(item).strip()
-            if value == '':
-                continue
-            for word in words:
-                if word == '':
-                    continue
-                s, rule = self._filter_item(value, word, match_on,
+        See :meth:`filter` for the other arguments.
+
+        """
+        if not query or not query.strip():
+            return items
+
+        query = query.strip()
+        fold_diacritics = self.settings.get('__workflow_diacritic_folding',
                                             fold_diacritics)
 
-                if not s:  # Skip items that don't match part of the query
-                    skip = True
-                score += s
+        words = self._filter_words(query, fold_diacritics)
+        matches = self._filter_field_matches(words, items, keys, match_on)
+        return self._filter_results(matches, ascending, include_score,
+                                    min_score, max_results)
 
-            if skip:
+    def _filter_field_matches(self, words, items, keys, match_on):
+        """Generate sortable matches like :meth:`_filter_matches` for
+        :meth:`filter_fields`.
+        """
+        for item in items:
+            fields = []
+            for filter_key, weight in keys(item):
+                if not weight:
+                    continue
+                if not isinstance(filter_key, FilterKey):
+                    filter_key = FilterKey(filter_key.strip())
+                if filter_key.value != '':
+                    fields.append((filter_key, weight))
+            if not fields:
                 continue
 
-            if score:
-                # use "reversed" `score` (i.e. highest becomes lowest) and
-                # `value` as sort key. This means items with the same score
-                # will be sorted in alphabetical not reverse alphabetical order
-                results.append(((100.0 / score, value.lower(), score),
-                                (item, score, rule)))
+            score = 0
+            for word, chars, fold in words:
+                best, rule = 0, None
+                for filter_key, weight in fields:
+                    form = filter_key.folded if fold else filter_key.plain
+                    s, r = self._filter_form(form, word, match_on, chars)
+                    if s and (rule is None or s * weight > best):
+                        best, rule = s * weight, r
+
+                if not best:  # no key matches this part of the query
+                    break
+                score += best
+            else:
+                if score:
+                    yield ((100.0 / score, fields[0][0].plain.lower, score),
+                           (item, score, rule))
+
+    def _filter_words(self, query, fold_diacritics):
+        """Split stripped ``query`` into ``(word, chars, fold)`` tuples.
 
-        # sort on keys, then discard the keys
-        results.sort(reverse=ascending)
-        results = [t[1] for t in results]
+        ``chars`` is the set of characters in ``word`` and ``fold``
+        whether ``word`` is matched against the ASCII-folded search keys.
 
-        if min_score:
-            results = [r for r in results if r[1] > min_score]
+        """
+        words = [s.strip().lower() for s in query.split(' ')]
+        return [(word, set(word), fold_diacritics and isascii(word))
+                for word in words if word]
+
+    def _filter_results(self, matches, ascending, include_score, min_score,
+                        max_results):
+        """Sort ``matches`` from :meth:`_filter_matches` into results.
 
-        if max_results and len(results) > max_results:
-            results = results[:max_results]
+        See :meth:`filter` for the arguments.
+
+        """
+        if min_score:
+            matches = (m for m in matches if m[1][1] > min_score)
+
+        # sort on keys. With ``max_results``, only the best results are
+        # kept on a heap while matching instead of sorting every match;
+        # heapq's selection is equivalent to sorting then slicing.
+        if max_results:
+            if ascending:
+                results = heapq.nlargest(max_results, matches)
+            else:
+                results = heapq.nsmallest(max_results, matches)
+        else:
+            results = sorted(matches, reverse=ascending)
 
         # return list of ``(item, score, rule)``
         if include_score:
-            return results
+            return [t[1] for t in results]
         # just return list of items
-        return [t[0] for t in results]
+        return [t[1][0] for t in results]
+
+    def _score_matches(self, words, pairs, match_on):
+        """Return :meth:`_filter_matches` for ``pairs``, computed by the
+        NumPy engine if :attr:`batch_filter` is set and there are at least
+        :const:`BATCH_FILTER_THRESHOLD`.
+
+        :param pairs: ``(item, search_key)`` tuples
+        :type pairs: ``list``
+
+        """
+        if (self.batch_filter and BATCH_FILTER_THRESHOLD and
+                len(pairs) >= BATCH_FILTER_THRESHOLD):
+            try:
+                from . import batchfilter
+            except ImportError:  # NumPy is not installed
+                pass
+            else:
+                if batchfilter.supported(words):
+                    return batchfilter.filter_matches(self, words, pairs,
+                                                      match_on)
+
+        return self._filter_matches(words, pairs, match_on)
+
+    def _filter_matches(self, words, pairs, match_on):
+        """Generate sortable ``(sort_key, (item, score, rule))`` matches.
+
+        :param words: query words from :meth:`_filter_words`
+        :param pairs: ``(item, search_key)`` tuples
+
+        """
+        for item, filter_key in pairs:
+            if not isinstance(filter_key, FilterKey):
+                filter_key = FilterKey(filter_key.strip())
+            if filter_key.value == '':
+                continue
+
+            score = 0
+            for word, chars, fold in words:
+                form = filter_key.folded if fold else filter_key.plain
+                s, rule = self._filter_form(form, word, match_on, chars)
+
+                if not s:  # Skip items that don't match part of the query
+                    break
+                score += s
+            else:
+                if score:
+                    # use "reversed" `score` (i.e. highest becomes lowest)
+                    # and `value` as sort key. This means items with the
+                    # same score will be sorted in alphabetical not reverse
+                    # alphabetical order
+                    yield ((100.0 / score, filter_key.plain.lower, score),
+                           (item, score, rule))
+
+    def filter_key(self, value):
+        """Return a precompiled :class:`FilterKey` for search key ``value``.
+
+        Pass these to :meth:`filter` (via its ``key`` argument) instead of
+        plain strings to avoid recomputing them on every search.
+
+        :param value: search key
+        :type value: ``unicode``
+        :returns: :class:`FilterKey` for ``value``
+
+        """
+        return FilterKey(value.strip()).compile()
 
     def _filter_item(self, value, query, match_on, fold_diacritics):
         """Filter ``value`` against ``query`` using rules ``match_on``.
@@ -2121,46 +2881,42 @@ class Workflow(object):
         if not isascii(query):
             fold_diacritics = False
 
+        filter_key = FilterKey(value)
         if fold_diacritics:
-            value = self.fold_to_ascii(value)
+            return self._filter_form(filter_key.folded, query, match_on)
+        return self._filter_form(filter_key.plain, query, match_on)
 
+    def _filter_form(self, form, query, match_on, query_chars=None):
+        """Filter key ``form`` against lowercase ``query``.
+
+        :returns: ``(score, rule)``
+
+        """
         # pre-filter any items that do not contain all characters
         # of ``query`` to save on running several more expensive tests
-        if not set(query) <= set(value.lower()):
+        if not (query_chars or set(query)) <= form.chars:
 
             return (0, None)
 
         # item starts with query
-        if match_on & MATCH_STARTSWITH and value.lower().startswith(query):
-            score = 100.0 - (len(value) / len(query))
+        if match_on & MATCH_STARTSWITH and form.lower.startswith(query):
+            score = 100.0 - (len(form.value) / len(query))
 
             return (score, MATCH_STARTSWITH)
 
         # query matches capitalised letters in item,
         # e.g. of = OmniFocus
-        if match_on & MATCH_CAPITALS:
-            initials = ''.join([c for c in value if c in INITIALS])
-            if initials.lower().startswith(query):
-                score = 100.0 - (len(initials) / len(query))
-
-                return (score, MATCH_CAPITALS)
-
-        # split the item into "atoms", i.e. words separated by
-        # spaces or other non-word characters
-        if (match_on & MATCH_ATOM or
-                match_on & MATCH_INITIALS_CONTAIN or
-                match_on & MATCH_INITIALS_STARTSWITH):
-            atoms = [s.lower() for s in split_on_delimiters(value)]
-            # print('atoms : %s  -->  %s' % (value, atoms))
-            # initials of the atoms
-            initials = ''.join([s[0] for s in atoms if s])
+        if match_on & MATCH_CAPITALS and form.capitals.startswith(query):
+            score = 100.0 - (len(form.capitals) / len(query))
+
+            return (score, MATCH_CAPITALS)
 
         if match_on & MATCH_ATOM:
             # is `query` one of the atoms in item?
             # similar to substring, but scores more highly, as it's
             # a word within the item
-            if query in atoms:
-                score = 100.0 - (len(value) / len(query))
+            if query in form.atoms:
+                score = 100.0 - (len(form.value) / len(query))
 
                 return (score, MATCH_ATOM)
 
@@ -2169,22 +2925,22 @@ class Workflow(object):
         # *and* "how i met your mother" (the ``capitals`` rule only
         # matches the former)
         if (match_on & MATCH_INITIALS_STARTSWITH and
-                initials.startswith(query)):
-            score = 100.0 - (len(initials) / len(query))
+                form.initials.startswith(query)):
+            score = 100.0 - (len(form.initials) / len(query))
 
             return (score, MATCH_INITIALS_STARTSWITH)
 
         # `query` is a substring of initials, e.g. ``doh`` matches
         # "The Dukes of Hazzard"
         elif (match_on & MATCH_INITIALS_CONTAIN and
-                query in initials):
-            score = 95.0 - (len(initials) / len(query))
+                query in form.initials):
+            score = 95.0 - (len(form.initials) / len(query))
 
             return (score, MATCH_INITIALS_CONTAIN)
 
         # `query` is a substring of item
-        if match_on & MATCH_SUBSTRING and query in value.lower():
-            score = 90.0 - (len(value) / len(query))
+        if match_on & MATCH_SUBSTRING and query in form.lower:
+            score = 90.0 - (len(form.value) / len(query))
 
             return (score, MATCH_SUBSTRING)
 
@@ -2192,7 +2948,7 @@ class Workflow(object):
         # characters in `query` are in item.
         if match_on & MATCH_ALLCHARS:
             search = self._search_for_query(query)
-            match = search(value)
+            match = search(form.value)
             if match:
                 score = 100.0 / ((1 + match.start()) *
                                  (match.end() - match.start() + 1))
@@ -2828,27 +3584,33 @@ class Workflow(object):
 
     def open_log(self):
         """Open :attr:`logfile` in default app (usually Console.app)."""
+        import subprocess
         subprocess.call(['open', self.logfile])
 
     def open_cachedir(self):
         """Open the workflow's :attr:`cachedir` in Finder."""
+        import subprocess
         subprocess.call(['open', self.cachedir])
 
     def open_datadir(self):
         """Open the workflow's :attr:`datadir` in Finder."""
+        import subprocess
         subprocess.call(['open', self.datadir])
 
     def open_workflowdir(self):
         """Open the workflow's :attr:`workflowdir` in Finder."""
+        import subprocess
         subprocess.call(['open', self.workflowdir])
 
     def open_terminal(self):
         """Open a Terminal window at workflow's :attr:`workflowdir`."""
+        import subprocess
         subprocess.call(['open', '-a', 'Terminal',
                         self.workflowdir])
 
     def open_help(self):
         """Open :attr:`help_url` in default browser."""
+        import subprocess
         subprocess.call(['open', self.help_url])
 
         return 'Opening workflow help URL in browser'
@@ -2904,11 +3666,7 @@ class Workflow(object):
         :rtype: ``unicode``
 
         """
-        if isascii(text):
-            return text
-        text = ''.join([ASCII_REPLACEMENTS.get(c, c) for c in text])
-        return unicode(unicodedata.normalize('NFKD',
-                       text).encode('ascii', 'ignore'))
+        return fold_to_ascii(text)
 
     def dumbify_punctuation(self, text):
         """Convert non-ASCII punctuation to closest ASCII equivalent.
@@ -2995,6 +3753,7 @@ class Workflow(object):
         :rtype: `tuple` (`int`, ``unicode``)
 
         """
+        import subprocess
         cmd = ['security', action, '-s', service, '-a', account] + list(args)
         p = subprocess.Popen(cmd, stdout=subprocess.PIPE,
                              stderr=subprocess.STDOUT)
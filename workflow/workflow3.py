@@ -27,9 +27,14 @@ from __future__ import print_function, unicode_literals, absolute_import
 
 import json
 import os
+import re
 import sys
 
-from .workflow import Workflow
+from .workflow import FilterKey, MATCH_ALL, Workflow
+
+#: Seconds after which Alfred re-runs a Script Filter that returned stale
+#: data while it is refreshed, see :meth:`Workflow3.cached_data`
+REFRESH_RERUN = 1
 
 
 class Variables(dict):
@@ -446,6 +451,32 @@ class Item3(object):
         return None
 
 
+_in_order_patterns = {}
+
+
+def _in_order(word):
+    """Return a function testing whether a string contains all characters
+    of ``word`` in order.
+    """
+    match = _in_order_patterns.get(word)
+    if match is None:
+        match = re.compile(''.join(
+            '[^{0}]*{0}'.format(re.escape(c)) for c in word), re.DOTALL).match
+        _in_order_patterns[word] = match
+    return match
+
+
+def _extends(words, previous):
+    """Whether query ``words`` extend the ``(word, fold)`` pairs of the
+    previous query, i.e. each previous word is a prefix of the word in
+    the same place, matched against the same search key form.
+    """
+    if len(words) < len(previous):
+        return False
+    return all(word.startswith(old) and fold == old_fold
+               for (word, _, fold), (old, old_fold) in zip(words, previous))
+
+
 class Workflow3(Workflow):
     """Workflow class that generates Alfred 3 feedback.
 
@@ -467,10 +498,25 @@ class Workflow3(Workflow):
 
         """
         Workflow.__init__(self, **kwargs)
+        # Get session ID from environment if present
+        self.reset(os.getenv('_WF_SESSION_ID') or None)
+
+    def reset(self, session_id=None):
+        """Forget the feedback of the previous run.
+
+        For long-running processes that answer several Script Filter runs
+        with the same object.
+
+        Args:
+            session_id (unicode, optional): Alfred session of the next run,
+                see :attr:`session_id`. A new one is made if needed.
+
+        """
+        self._items = []
         self.variables = {}
         self._rerun = 0
-        # Get session ID from environment if present
-        self._session_id = os.getenv('_WF_SESSION_ID') or None
+        self.refreshing = set()
+        self._session_id = session_id
         if self._session_id:
             self.setvar('_WF_SESSION_ID', self._session_id)
 
@@ -516,8 +562,9 @@ class Workflow3(Workflow):
 
         """
         if not self._session_id:
-            from uuid import uuid4
-            self._session_id = uuid4().hex
+            # not uuid4: importing uuid loads ctypes and subprocess
+            from binascii import hexlify
+            self._session_id = hexlify(os.urandom(16)).decode('ascii')
             self.setvar('_WF_SESSION_ID', self._session_id)
 
         return self._session_id
@@ -587,7 +634,7 @@ class Workflow3(Workflow):
         """New cache name/key based on session ID."""
         return self._session_prefix + name
 
-    def cache_data(self, name, data, session=False):
+    def cache_data(self, name, data, session=False, compression=None):
         """Cache API with session-scoped expiry.
 
         .. versionadded:: 1.25
@@ -597,8 +644,10 @@ class Workflow3(Workflow):
             data (object): Data to cache
             session (bool, optional): Whether to scope the cache
                 to the current session.
+            compression (str, optional): Codec to compress the cache
+                file with.
 
-        ``name`` and ``data`` are the same as for the
+        ``name``, ``data`` and ``compression`` are the same as for the
         :meth:`~workflow.Workflow.cache_data` method on
         :class:`~workflow.Workflow`.
 
@@ -609,9 +658,10 @@ class Workflow3(Workflow):
         if session:
             name = self._mk_session_name(name)
 
-        return super(Workflow3, self).cache_data(name, data)
+        return super(Workflow3, self).cache_data(name, data, compression)
 
-    def cached_data(self, name, data_func=None, max_age=60, session=False):
+    def cached_data(self, name, data_func=None, max_age=60, session=False,
+                    refresh=None, compression=None):
         """Cache API with session-scoped expiry.
 
         .. versionadded:: 1.25
@@ -623,8 +673,13 @@ class Workflow3(Workflow):
             max_age (int): Maximum allowable age of cache in seconds.
             session (bool, optional): Whether to scope the cache
                 to the current session.
+            refresh (list, optional): Command refreshing stale data in
+                the background.
+            compression (str, optional): Codec to compress the data
+                returned by ``data_func`` with.
 
-        ``name``, ``data_func`` and ``max_age`` are the same as for the
+        ``name``, ``data_func``, ``max_age``, ``refresh`` and
+        ``compression`` are the same as for the
         :meth:`~workflow.Workflow.cached_data` method on
         :class:`~workflow.Workflow`.
 
@@ -635,7 +690,114 @@ class Workflow3(Workflow):
         if session:
             name = self._mk_session_name(name)
 
-        return super(Workflow3, self).cached_data(name, data_func, max_age)
+        return super(Workflow3, self).cached_data(name, data_func, max_age,
+                                                  refresh, compression)
+
+    def refresh_in_background(self, name, args):
+        """Refresh stale data in the background.
+
+        Same as :meth:`~workflow.Workflow.refresh_in_background`, but also
+        sets :attr:`rerun` (unless it already is), so Alfred shows the
+        fresh data once it is there.
+
+        Args:
+            name (str): Name of the stale data.
+            args (list): Command to run.
+
+        """
+        super(Workflow3, self).refresh_in_background(name, args)
+        if not self.rerun:
+            self.rerun = REFRESH_RERUN
+
+    def filter(self, query, items, key=lambda x: x, ascending=False,
+               include_score=False, min_score=0, max_results=0,
+               match_on=MATCH_ALL, fold_diacritics=True, index=None,
+               session=None, item_id=None):
+        """Fuzzy search filter that can narrow results as the user types.
+
+        Args:
+            session (unicode, optional): Name under which the items that
+                may match ``query`` are remembered for the current session.
+            item_id (callable, optional): Function returning a
+                hashable ID for an item that changes whenever the item's
+                search key may have changed, e.g. an ID and a modification
+                time. Required with ``session``.
+
+        The other arguments are the same as for the
+        :meth:`~workflow.Workflow.filter` method on
+        :class:`~workflow.Workflow`.
+
+        If ``session`` is given and ``query`` extends the query of the
+        previous call with the same ``session`` (e.g. ``refa`` after
+        ``ref``), only the items that could match the previous query are
+        scored, not all of ``items``. Any other edit, or a different set
+        of ``items``, scans all ``items`` again; an item whose ID changed
+        counts as a different item. Use one ``session`` name per
+        combination of ``key`` and ``match_on``.
+
+        Every rule only matches items whose search key contains each
+        query word's characters in order, so an item that fails that test
+        for the previous query cannot match its extension. The results
+        are therefore the same as those of a full scan.
+
+        Returns:
+            list: See :meth:`~workflow.Workflow.filter`.
+
+        """
+        if not session or not query or not query.strip():
+            return super(Workflow3, self).filter(
+                query, items, key, ascending, include_score, min_score,
+                max_results, match_on, fold_diacritics, index)
+
+        query = query.strip()
+        fold_diacritics = self.settings.get('__workflow_diacritic_folding',
+                                            fold_diacritics)
+        words = self._filter_words(query, fold_diacritics)
+        if index is not None:
+            items = index.items
+        signature = hash(frozenset([item_id(item) for item in items]))
+
+        name = 'filter-{0}'.format(session)
+        previous = self.cached_data(name, max_age=0, session=True)
+        narrowed = None
+        if (previous and previous['items'] == signature and
+                _extends(words, previous['words'])):
+            narrowed = previous['candidates']
+            self.logger.debug('filter %r: narrowed to %d candidates',
+                              session, len(narrowed))
+
+        if index is not None:
+            pairs = index.candidates(words, match_on)
+        else:
+            pairs = ((item, None) for item in items)
+
+        tests = [(_in_order(word), fold) for word, _, fold in words]
+        candidates = []
+        candidate_ids = set()
+        for item, filter_key in pairs:
+            id_ = item_id(item)
+            if narrowed is not None and id_ not in narrowed:
+                continue
+            if filter_key is None:
+                filter_key = key(item)
+            if not isinstance(filter_key, FilterKey):
+                filter_key = FilterKey(filter_key.strip())
+            if filter_key.value and all(
+                    in_order((filter_key.folded if fold
+                              else filter_key.plain).lower)
+                    for in_order, fold in tests):
+                candidates.append((item, filter_key))
+                candidate_ids.add(id_)
+
+        self.cache_data(name, {
+            'items': signature,
+            'words': [(word, fold) for word, _, fold in words],
+            'candidates': candidate_ids,
+        }, session=True)
+
+        matches = self._score_matches(words, candidates, match_on)
+        return self._filter_results(matches, ascending, include_score,
+                                    min_score, max_results)
 
     def clear_session_cache(self, current=False):
         """Remove session data from the cache.